@@ -0,0 +1,308 @@
+"""
+Benchmark and load test for the trivia API.
+
+Seeds a local SQLite database with --questions questions, then drives
+every endpoint through the Flask test client (in process) and through a
+threaded HTTP server with --concurrency concurrent clients. Reports p50,
+p95 and p99 latency, throughput and peak RSS per endpoint, and fails when
+latency or throughput is worse than the stored baseline by more than
+--tolerance, or peak RSS by more than --rss-tolerance.
+
+    python benchmarks/bench_trivia.py --questions 100000
+    python benchmarks/bench_trivia.py --save-baseline
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import db, Question, Category
+from migrations import upgrade
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+WORDS = ('title', 'river', 'movie', 'planet', 'king', 'ocean', 'actor', 'war',
+         'painting', 'goal', 'city', 'element', 'novel', 'team', 'mountain')
+
+
+def seed(app, count, batch_size=10000):
+    '''
+    schema, then count questions spread over the six categories,
+    inserted in batches
+    '''
+    rng = random.Random(42)
+    with app.app_context():
+        upgrade(db.engine)
+        db.session.execute(Category.__table__.insert(), [{'type': type} for type in CATEGORIES])
+        for start in range(0, count, batch_size):
+            db.session.execute(Question.__table__.insert(), [
+                {
+                    'question': 'Which {} {} the {} {}?'.format(*rng.sample(WORDS, 3), i),
+                    'answer': rng.choice(WORDS),
+                    'category': rng.randint(1, len(CATEGORIES)),
+                    'difficulty': rng.randint(1, 5)
+                }
+                for i in range(start, min(start + batch_size, count))
+            ])
+            db.session.commit()
+
+
+def endpoints(count):
+    '''
+    (name, method, path-or-factory, json body) of the requests to time
+    '''
+    last_page = max(count // 10, 1)
+    # every delete takes a question of its own, in random order
+    deletable = list(range(1, count + 1))
+    random.shuffle(deletable)
+    return [
+        ('categories', 'GET', '/categories', None),
+        ('questions_first_page', 'GET', '/questions?page=1', None),
+        ('questions_random_page', 'GET', lambda: '/questions?page={}'.format(random.randint(1, last_page)), None),
+        ('questions_deep_cursor', 'GET', lambda: '/questions?after_id={}'.format(random.randint(1, count - 20)), None),
+        ('category_questions', 'GET', lambda: '/categories/{}/questions'.format(random.randint(1, 6)), None),
+        ('search', 'POST', '/questions/search', lambda: {'searchTerm': random.choice(WORDS)}),
+        ('quiz', 'POST', '/quizzes', lambda: {
+            'quiz_category': {'id': random.randint(0, 6)},
+            'previous_questions': random.sample(range(1, count), min(20, count - 1))
+        }),
+        ('create_question', 'POST', '/questions', lambda: {
+            'question': 'Benchmark question?', 'answer': 'yes', 'category': 1, 'difficulty': 1
+        }),
+        # last, so the other endpoints run on every seeded question
+        ('delete_question', 'DELETE', lambda: '/questions/{}'.format(deletable.pop() if deletable else 0), None),
+    ]
+
+
+def resolve(value):
+    return value() if callable(value) else value
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def current_rss():
+    '''
+    resident set size in bytes, from /proc on Linux
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class RssSampler:
+    '''samples the process RSS in the background to get the peak of a run'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def summarize(latencies, elapsed, peak_rss, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'peak_rss_mb': round(peak_rss / 2 ** 20, 1)
+    }
+
+
+def run_test_client(app, endpoint, requests):
+    '''
+    requests sent one after the other through the Flask test client
+    '''
+    name, method, path, body = endpoint
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        for _ in range(requests):
+            url, payload = resolve(path), resolve(body)
+            start = time.perf_counter()
+            res = client.open(url, method=method, json=payload)
+            latencies.append(time.perf_counter() - start)
+            errors += res.status_code >= 400
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, rss.peak, errors)
+
+
+def run_http(port, endpoint, requests, concurrency):
+    '''
+    requests spread over concurrency keep-alive HTTP clients
+    '''
+    name, method, path, body = endpoint
+    per_client = max(requests // concurrency, 1)
+
+    def client(_):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        latencies = []
+        errors = 0
+        for _ in range(per_client):
+            url, payload = resolve(path), resolve(body)
+            data = json.dumps(payload) if payload is not None else None
+            start = time.perf_counter()
+            connection.request(method, url, body=data, headers={'Content-Type': 'application/json'})
+            res = connection.getresponse()
+            res.read()
+            latencies.append(time.perf_counter() - start)
+            errors += res.status >= 400
+        connection.close()
+        return latencies, errors
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(client, range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies = [latency for result in results for latency in result[0]]
+    return summarize(latencies, elapsed, rss.peak, sum(result[1] for result in results))
+
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    '''
+    regressions against the baseline: more errors, median latency above
+    or throughput below the baseline value by more than tolerance (a
+    fraction), or peak RSS above it by more than rss_tolerance. The tail
+    percentiles are reported but too noisy to gate on.
+    '''
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get('results', {}).get(key)
+        if expected is None:
+            continue
+        if result['errors'] > expected['errors']:
+            regressions.append('{}: {} errors, baseline {}'.format(key, result['errors'], expected['errors']))
+        if result['p50_ms'] > expected['p50_ms'] * (1 + tolerance):
+            regressions.append('{}: p50 {} ms, baseline {} ms'.format(key, result['p50_ms'], expected['p50_ms']))
+        if result['throughput_rps'] < expected['throughput_rps'] * (1 - tolerance):
+            regressions.append('{}: {} req/s, baseline {} req/s'.format(
+                key, result['throughput_rps'], expected['throughput_rps']))
+        if result['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + rss_tolerance):
+            regressions.append('{}: peak RSS {} MB, baseline {} MB'.format(
+                key, result['peak_rss_mb'], expected['peak_rss_mb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=10000, help='questions to seed (1k to 1M)')
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint and mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='both')
+    parser.add_argument('--response-cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed regression, as a fraction')
+    parser.add_argument('--rss-tolerance', type=float, default=0.2, help='allowed peak RSS growth, as a fraction')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    database = os.path.join(tempfile.mkdtemp(prefix='trivia-bench-'), 'trivia.db')
+    app = create_app({
+        'DATABASE_PATH': 'sqlite:///' + database,
+        'RESPONSE_CACHE_ENABLED': args.response_cache,
+        # the load is a single client address
+        'RATE_LIMIT_ENABLED': False,
+    })
+    started = time.perf_counter()
+    seed(app, args.questions)
+    print('seeded {} questions in {:.1f}s'.format(args.questions, time.perf_counter() - started))
+
+    results = {}
+    modes = ['client', 'http'] if args.mode == 'both' else [args.mode]
+    server = None
+    if 'http' in modes:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        for endpoint in endpoints(args.questions):
+            for mode in modes:
+                if mode == 'client':
+                    result = run_test_client(app, endpoint, args.requests)
+                else:
+                    result = run_http(server.server_port, endpoint, args.requests, args.concurrency)
+                key = '{}:{}'.format(mode, endpoint[0])
+                results[key] = result
+                print('{:<36} p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  p99 {p99_ms:>8} ms  '
+                      '{throughput_rps:>8} req/s  rss {peak_rss_mb:>7} MB  errors {errors}'.format(key, **result))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'config': {
+            'questions': args.questions,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'response_cache': args.response_cache
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(report, output, indent=2)
+        print('baseline saved to', args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline at', args.baseline)
+        return 0
+    with open(args.baseline) as stored:
+        baseline = json.load(stored)
+    if baseline.get('config') != report['config']:
+        print('baseline was recorded with {}, not comparing'.format(baseline.get('config')))
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.rss_tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
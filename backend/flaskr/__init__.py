@@ -1,32 +1,179 @@
 import os
+import time
 from unicodedata import category
-from flask import Flask, request, abort, jsonify, json
+from flask import Flask, request, abort, jsonify, json, stream_with_context, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import random
 
-from models import setup_db, Question, Category
+_imports_started = time.perf_counter()
+from models import setup_db, load_env, Question, Category, question_columns, format_row
+import migrations
+from .counts import question_counter
+from .quiz import quiz_sampler, quiz_sessions, MAX_PREFETCH, DIFFICULTIES, START_DIFFICULTY
+from .search import question_search, MAX_SUGGESTIONS
+from .categories import category_catalog
+from .cache import response_cache
+from . import bulk
+from . import replicas
+from . import tenants
+from .replicas import read_replica
+from .metrics import request_metrics
+from .compression import compressor
+from .serialization import json_provider
+from .limits import rate_limiter, admission
+from .leaderboard import leaderboard, MAX_PLAYER_LENGTH
+from . import startup
+from .startup import StartupProfile
+IMPORT_SECONDS = time.perf_counter() - _imports_started
 
 QUESTIONS_PER_PAGE = 10
 
 # pagination function for 10 questions a page,
 # and will be called on relevant endpoints:
 def paginate_questions(request, selection):
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-
-    return current_questions
+    '''
+    Paginate a Question query (ordered by Question.id) in the database.
+
+    ?page=N is applied as LIMIT/OFFSET. ?after_id=<id> switches to keyset
+    (cursor) mode: only rows with Question.id > after_id are read, so deep
+    pages cost the same as the first one.
+    Returns the formatted questions of the page and the next_cursor,
+    the id to pass as after_id for the next page (None on the last page).
+    '''
+    after_id = request.args.get("after_id", None, type=int)
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    else:
+        page = request.args.get("page", 1, type=int)
+        if page < 1:
+            return [], None
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    # fetch one extra row to know whether there is a next page;
+    # plain column tuples, not Question instances
+    rows = selection.with_entities(*question_columns()).limit(QUESTIONS_PER_PAGE + 1).all()
+    current_questions = [format_row(row) for row in rows[:QUESTIONS_PER_PAGE]]
+    next_cursor = None
+    if len(rows) > QUESTIONS_PER_PAGE:
+        next_cursor = rows[QUESTIONS_PER_PAGE - 1].id
+
+    return current_questions, next_cursor
+
+def stream_questions(request, selection):
+    '''
+    NDJSON response streaming every question of selection in id order,
+    after the ?after_id= question if given, with constant memory
+    '''
+    after_id = request.args.get("after_id", None, type=int)
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+
+    return current_app.response_class(
+        stream_with_context(bulk.export_questions('ndjson', selection=selection)),
+        mimetype='application/x-ndjson'
+    )
+
+def json_object(request):
+    '''
+    the JSON object body of request, {} without a (valid JSON) body;
+    400 for a body that is valid JSON but not an object
+    '''
+    body = request.get_json(silent=True)
+    if body is None:
+        return {}
+    if not isinstance(body, dict):
+        abort(400)
+    return body
 
 def create_app(test_config=None):
+    profile = StartupProfile(imports=IMPORT_SECONDS)
     # create and configure the app
+    load_env()
     app = Flask(__name__)
-    
+    app.config.from_mapping(
+        # 'exact' or 'approximate' (postgres planner estimate for the total,
+        # in databases holding a single tenant)
+        QUESTION_COUNT_MODE=os.getenv('QUESTION_COUNT_MODE', 'exact'),
+        QUESTION_COUNT_TTL=int(os.getenv('QUESTION_COUNT_TTL', 60)),
+        QUIZ_INDEX_TTL=int(os.getenv('QUIZ_INDEX_TTL', 300)),
+        QUIZ_SESSION_TTL=int(os.getenv('QUIZ_SESSION_TTL', 3600)),
+        # 'auto', 'database' (pg_trgm index on postgres) or 'memory'
+        SEARCH_BACKEND=os.getenv('SEARCH_BACKEND', 'auto'),
+        SEARCH_INDEX_TTL=int(os.getenv('SEARCH_INDEX_TTL', 300)),
+        # search results cached by normalized term, 0 entries to disable
+        SEARCH_CACHE_SIZE=int(os.getenv('SEARCH_CACHE_SIZE', 1024)),
+        SEARCH_CACHE_TTL=int(os.getenv('SEARCH_CACHE_TTL', 60)),
+        CATEGORY_CACHE_TTL=int(os.getenv('CATEGORY_CACHE_TTL', 600)),
+        RESPONSE_CACHE_ENABLED=os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+        RESPONSE_CACHE_MAX_BYTES=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        RESPONSE_CACHE_TTL=int(os.getenv('RESPONSE_CACHE_TTL', 300)),
+        IMPORT_BATCH_SIZE=int(os.getenv('IMPORT_BATCH_SIZE', 1000)),
+        # questions deleted or updated per statement by the bulk endpoints
+        BULK_BATCH_SIZE=int(os.getenv('BULK_BATCH_SIZE', 1000)),
+        # reads of a client that just wrote go to the primary this long
+        DB_REPLICA_STICKY_SECONDS=int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5)),
+        # per route latency and SQL stats, Server-Timing header and /metrics
+        METRICS_ENABLED=os.getenv('METRICS_ENABLED', 'true').lower() == 'true',
+        # 'auto' (orjson when installed), 'orjson' or 'stdlib'
+        JSON_SERIALIZER=os.getenv('JSON_SERIALIZER', 'auto'),
+        COMPRESSION_ENABLED=os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true',
+        COMPRESSION_MIN_SIZE=int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+        COMPRESSION_LEVEL=int(os.getenv('COMPRESSION_LEVEL', 6)),
+        # request header naming the tenant whose question bank is used
+        TENANT_HEADER=os.getenv('TENANT_HEADER', 'X-Tenant'),
+        # token buckets per client as 'requests/seconds'
+        RATE_LIMIT_ENABLED=os.getenv('RATE_LIMIT_ENABLED', 'false').lower() == 'true',
+        # proxies in front of the app whose X-Forwarded-For is trusted
+        TRUSTED_PROXIES=int(os.getenv('TRUSTED_PROXIES', 0)),
+        RATE_LIMIT_WRITE=os.getenv('RATE_LIMIT_WRITE', '30/60'),
+        RATE_LIMIT_SEARCH=os.getenv('RATE_LIMIT_SEARCH', '60/60'),
+        RATE_LIMIT_AUTOCOMPLETE=os.getenv('RATE_LIMIT_AUTOCOMPLETE', '600/60'),
+        RATE_LIMIT_QUIZ=os.getenv('RATE_LIMIT_QUIZ', '120/60'),
+        RATE_LIMIT_SCORE=os.getenv('RATE_LIMIT_SCORE', '30/60'),
+        # concurrent expensive requests per worker, 0 for no cap
+        ADMISSION_LIMIT=int(os.getenv('ADMISSION_LIMIT', 8)),
+        ADMISSION_QUEUE=int(os.getenv('ADMISSION_QUEUE', 16)),
+        ADMISSION_TIMEOUT=float(os.getenv('ADMISSION_TIMEOUT', 2)),
+        # best scores kept in memory per category, reloaded after the ttl
+        LEADERBOARD_SIZE=int(os.getenv('LEADERBOARD_SIZE', 100)),
+        LEADERBOARD_TTL=int(os.getenv('LEADERBOARD_TTL', 60)),
+        # new scores are written in batches of this size, or this often
+        SCORE_FLUSH_SIZE=int(os.getenv('SCORE_FLUSH_SIZE', 500)),
+        SCORE_FLUSH_INTERVAL=float(os.getenv('SCORE_FLUSH_INTERVAL', 5)),
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    app.json = json_provider(app)
+    if app.config['TRUSTED_PROXIES']:
+        # remote_addr of the client, not of the proxy, keys the rate limits
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+    profile.mark('config')
+
     with app.app_context():
-        setup_db(app)
+        # DATABASE_PATH in test_config points the app at another database;
+        # no connection is opened until the first query
+        setup_db(app, app.config.get('DATABASE_PATH'))
+    profile.mark('setup_db')
+    question_search.init_app(app)
+    tenants.init_app(app)
+    rate_limiter.init_app(app)
+    admission.init_app(app)
+    question_counter.init_app(app)
+    quiz_sampler.init_app(app)
+    quiz_sessions.init_app(app)
+    leaderboard.init_app(app)
+    category_catalog.init_app(app)
+    response_cache.init_app(app)
+    bulk.init_app(app)
+    migrations.init_app(app)
+    replicas.init_app(app)
+    request_metrics.init_app(app)
+    # after request_metrics, so that response sizes are measured compressed
+    compressor.init_app(app)
+    startup.init_app(app, profile)
+    profile.mark('extensions')
 
 
     """
@@ -59,26 +206,47 @@ def create_app(test_config=None):
     for all available categories.
     """
     @app.route('/categories')
+    @response_cache.cached
+    @read_replica
     def retrieve_categories():
         '''
         GET request to retrieve all categories
         '''
-        query = Category.query.order_by(Category.id).all()
-    
-        if len(query) == 0:
+        # category.id: category.type for category in query:
+        # format expected by frontend, FE, served from the catalog cache
+        if len(category_catalog.categories()) == 0:
             abort(405)
-            
-        else:
-            # category.id: category.type for category in query:
-            # format expected by frontend, FE.
-            categories = { category.id: category.type for category in query }
-            return jsonify(
-                {
-                    'success': True,
-                    'categories': categories,
-                    'total_categories': len(Category.query.all())
-                }
-            )
+
+        body, etag = category_catalog.body()
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # 304 Not Modified when If-None-Match has the same ETag
+        return response.make_conditional(request)
+
+    # categories of the tenant of the request; a new tenant starts
+    # without any and creates its own before adding questions
+    @app.route('/categories', methods=['POST'])
+    @rate_limiter.limit('write')
+    def create_category():
+        '''
+        POST endpoint to add a category
+        '''
+        body = json_object(request)
+        type = body.get('type')
+        if not isinstance(type, str) or not type.strip():
+            abort(400)
+        if type.strip() in category_catalog.categories().values():
+            abort(422)
+
+        category = Category(type=type.strip())
+        category.insert()
+
+        return jsonify(
+            {
+                'success': True,
+                'created': category.id
+            }
+        )
 
     """
     @TODO:
@@ -93,15 +261,18 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
     @app.route('/questions')
+    @response_cache.cached
+    @read_replica
     def retrieve_questions():
         '''
         GET request to retrieve questions, paginated: using prior defined f(n) paginate_questions()
         '''
         # total questions, current category for each question, categories.
-        categories = Category.query.order_by(Category.id).all()
-        
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        selection = Question.query.order_by(Question.id)
+        if bulk.wants_stream(request):
+            return stream_questions(request, selection)
+
+        current_questions, next_cursor = paginate_questions(request, selection)
         
         if len(current_questions) == 0:
             abort(404)
@@ -111,10 +282,9 @@ def create_app(test_config=None):
             {
                 'success': True,
                 'questions': current_questions,
-                'total_questions': len(selection),
-                'categories': {
-                    category.id: category.type for category in categories
-                    }
+                'total_questions': question_counter.total(),
+                'next_cursor': next_cursor,
+                'categories': category_catalog.categories()
             }
         )
 
@@ -127,6 +297,7 @@ def create_app(test_config=None):
     This removal will persist in the database and when you refresh the page.
     """
     @app.route('/questions/<int:id>', methods=['DELETE'])
+    @rate_limiter.limit('write')
     def delete_question(id):
         '''
         Endpoint for: DELETE a question
@@ -149,7 +320,64 @@ def create_app(test_config=None):
 
         else:
             abort(404)
-            
+
+    # bulk delete and update of many questions, e.g. for moderation:
+    # one set-based statement per batch instead of a request per question
+    @app.route('/questions', methods=['DELETE'])
+    @rate_limiter.limit('write')
+    @admission
+    def bulk_delete_questions():
+        '''
+        DELETE the questions of a list of ids or matching a filter
+        '''
+        body = json_object(request)
+        selection = bulk.select_questions(body)
+        if isinstance(selection, str):
+            return bulk_error(selection)
+        ids, criteria = selection
+
+        deleted = bulk.change_questions('delete', ids, criteria, batch_size=app.config['BULK_BATCH_SIZE'])
+        return jsonify(
+            {
+                'success': True,
+                'deleted': deleted
+            }
+        )
+
+    @app.route('/questions', methods=['PATCH'])
+    @rate_limiter.limit('write')
+    @admission
+    def bulk_update_questions():
+        '''
+        PATCH category and/or difficulty of the questions of a list of ids
+        or matching a filter
+        '''
+        body = json_object(request)
+        selection = bulk.select_questions(body)
+        if isinstance(selection, str):
+            return bulk_error(selection)
+        ids, criteria = selection
+        values = bulk.validate_changes(body.get('set'))
+        if isinstance(values, str):
+            return bulk_error(values)
+
+        updated = bulk.change_questions('update', ids, criteria, values,
+                                        batch_size=app.config['BULK_BATCH_SIZE'])
+        return jsonify(
+            {
+                'success': True,
+                'updated': updated
+            }
+        )
+
+    def bulk_error(message):
+        return (
+            jsonify({'success': False,
+                     'error': 400,
+                     'message': message}),
+            400
+        )
+
 
     """
     @TODO:
@@ -165,17 +393,26 @@ def create_app(test_config=None):
     # to check(using search on /questions/search endpoint)
     # IF EXISTS before adding it.
     @app.route('/questions', methods=['POST'])
+    @rate_limiter.limit('write')
     def create_question():
         '''
         POST endpoint to add a new question. 
         '''
-        body = request.get_json()
+        body = json_object(request)
+        # the category has to be one of the tenant's own categories
+        try:
+            category = int(body.get('category'))
+        except (TypeError, ValueError):
+            abort(422)
+        if category_catalog.type(category) is None:
+            abort(422)
+
         # create question with values for each field from the request body
         try:
             question = Question(question=body.get('question'),
                             answer=body.get('answer'),
                             difficulty=body.get('difficulty'),
-                            category=body.get('category')
+                            category=category
                 )
             
             question.insert()
@@ -191,6 +428,53 @@ def create_app(test_config=None):
             abort(405)
 
 
+    # bulk import: NDJSON (default) or CSV (Content-Type: text/csv or ?format=csv)
+    # streamed from the request body and inserted in batches
+    @app.route('/questions/import', methods=['POST'])
+    @rate_limiter.limit('write')
+    @admission
+    def bulk_import_questions():
+        '''
+        POST endpoint to add many questions at once
+        '''
+        format = request.args.get('format', None)
+        if format is None:
+            format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        if format not in ('ndjson', 'csv'):
+            abort(400)
+        batch_size = request.args.get('batch_size', app.config['IMPORT_BATCH_SIZE'], type=int)
+        if batch_size < 1:
+            abort(400)
+
+        lines = bulk.text_lines(request.stream)
+        records = bulk.read_csv(lines) if format == 'csv' else bulk.read_ndjson(lines)
+        inserted, errors, error_count = bulk.import_questions(records, batch_size)
+
+        return jsonify(
+            {
+                'success': True,
+                'inserted': inserted,
+                'rejected': error_count,
+                'errors': errors
+            }
+        )
+
+    @app.route('/questions/export')
+    @read_replica
+    def bulk_export_questions():
+        '''
+        GET all questions as a streamed NDJSON (default) or CSV download
+        '''
+        format = request.args.get('format', 'ndjson')
+        if format not in ('ndjson', 'csv'):
+            abort(400)
+        mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+
+        return app.response_class(
+            stream_with_context(bulk.export_questions(format)), mimetype=mimetype
+        )
+
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -202,28 +486,57 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
     @app.route('/questions/search', methods=['POST'])
+    @rate_limiter.limit('search')
+    @admission
+    @read_replica
     def search_questions():
         '''
         POST to look up questions based a 'search' term
         '''
-        body = request.get_json()
+        body = json_object(request)
         searchTerm = body.get('searchTerm', None)
-        if searchTerm:
-            # search term formatted()
-            selection = Question.query.order_by(Question.id).filter(
-                Question.question.ilike(f'%{searchTerm}%')
-            )
-            questions = paginate_questions(request, selection)
+        if not isinstance(searchTerm, str) or not searchTerm.strip():
+            abort(400)
+
+        page = request.args.get("page", 1, type=int)
+        after_id = request.args.get("after_id", None, type=int)
+        if page < 1:
+            page = 1
+        # ranked results from the search index, same response format
+        questions, total_questions, next_cursor = question_search.search(
+            searchTerm, page=page, after_id=after_id, per_page=QUESTIONS_PER_PAGE
+        )
 
-            return jsonify(
-                {
-                    'success': True,
-                    'questions': questions,
-                    'total_questions': len(selection.all())
-                }
-            )
-        if selection is None:
-            abort(404)
+        result = {
+            'success': True,
+            'questions': questions,
+            'total_questions': total_questions
+        }
+        # ranked pages are numbered, only id ordered pages have a cursor
+        if after_id is not None:
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
+
+    
+    # type-ahead for the search box, served from an in-memory prefix trie
+    @app.route('/questions/autocomplete')
+    @rate_limiter.limit('autocomplete')
+    @read_replica
+    def autocomplete_questions():
+        '''
+        GET words of question text starting with ?q=, for suggestions
+        '''
+        prefix = request.args.get('q', '').strip()
+        limit = request.args.get('limit', 10, type=int)
+        if not prefix or not 1 <= limit <= MAX_SUGGESTIONS:
+            abort(400)
+
+        return jsonify(
+            {
+                'success': True,
+                'suggestions': question_search.suggest(prefix, limit)
+            }
+        )
 
     
     """
@@ -235,6 +548,8 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:id>/questions', methods=['GET'])
+    @response_cache.cached
+    @read_replica
     def categorised_questions(id):
         '''
         GET endpoint for questions based on category
@@ -245,18 +560,22 @@ def create_app(test_config=None):
         # category name is returned in json-
         # with category.type, from Category's 'type' attribute
         
-        category = Category.query.filter(Category.id == id).one_or_none()
-        if category:
+        category_type = category_catalog.type(id)
+        if category_type:
             selection = Question.query.filter(Question.category == id).order_by(Question.id)
-            questions = paginate_questions(request, selection)
+            if bulk.wants_stream(request):
+                return stream_questions(request, selection)
+
+            questions, next_cursor = paginate_questions(request, selection)
 
             # 'current_category': category.type returns expected category name-string
             return jsonify(
                 {
                     'success': True,
                     'questions': questions,
-                    'total_questions': len(selection.all()),
-                    'current_category': category.type
+                    'total_questions': question_counter.total(id),
+                    'next_cursor': next_cursor,
+                    'current_category': category_type
                     
                 }
             )
@@ -278,6 +597,9 @@ def create_app(test_config=None):
     """
     # 'Trivia' endpoint 
     @app.route('/quizzes', methods=['POST'])
+    @rate_limiter.limit('quiz')
+    @admission
+    @read_replica
     def quiz_game():
         ''' 
         Play quiz game: randomize questions 
@@ -286,25 +608,35 @@ def create_app(test_config=None):
             body = request.get_json()
             previous_questions = body.get('previous_questions', None)
             quiz_category = body.get('quiz_category', None)
-             
-            if quiz_category:
-                # query quiz list of questions 
-                # based on user's quiz_category(Question.category == quiz_category['id])
-                quiz_list = Question.query.filter(Question.category == quiz_category['id']).all()
-                
-                if quiz_category['id'] == 0:
-                    # all randomized questions quiz list for clicking 'ALL' category
-                    quiz_list = Question.query.order_by(Question.id).all()
-        
-            # list of available IDs in quiz_list
-            # then generate randmo_num out of IDs using list method random.choice
-            available_ids = [question.id for question in quiz_list]
-            random_num = random.choice([num for num in available_ids if num not in previous_questions])
-            
-            # random question using random_num(as id) that match Question.id field
-            question = Question.query.filter(Question.id == random_num).one_or_none()
-            previous_questions.append(question.id)
-            print('count previous_quetions', len(previous_questions))
+
+            # quiz_category is {'id': ..., 'type': ...} from the FE,
+            # id 0 is the 'ALL' category
+            if isinstance(quiz_category, dict):
+                quiz_category = quiz_category['id']
+            category_id = int(quiz_category or 0)
+
+            # with difficulty, questions of that difficulty, or of the
+            # closest one left, from the (category, difficulty) id buckets
+            difficulty = body.get('difficulty', None)
+            if difficulty is not None:
+                difficulty = min(max(int(difficulty), DIFFICULTIES[0]), DIFFICULTIES[-1])
+
+            # with count, a round of up to count unseen questions (at most
+            # MAX_PREFETCH) drawn at once and fetched with one IN query
+            count = body.get('count', None)
+            if count is not None:
+                count = min(max(int(count), 1), MAX_PREFETCH)
+                questions = quiz_sampler.questions(category_id, previous_questions, count, difficulty)
+                return jsonify(
+                    {
+                        'success': True,
+                        'questions': [question.format() for question in questions]
+                    }
+                )
+
+            # random unseen question id drawn from the in-memory id index,
+            # the question itself is a single lookup by primary key
+            question = quiz_sampler.question(category_id, previous_questions, difficulty)
             
             return jsonify(
                 {
@@ -318,6 +650,178 @@ def create_app(test_config=None):
     
 
 
+    # quiz sessions: the server keeps the questions already played,
+    # so the client only sends its session id for the next question
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @rate_limiter.limit('quiz')
+    def start_quiz_session():
+        '''
+        Start a quiz session for a category (0 or none for all categories),
+        adaptive with "adaptive": true
+        '''
+        body = json_object(request)
+        quiz_category = body.get('quiz_category', None)
+        if isinstance(quiz_category, dict):
+            quiz_category = quiz_category.get('id')
+        try:
+            category_id = int(quiz_category or 0)
+        except (TypeError, ValueError):
+            abort(422)
+
+        # adaptive sessions follow the answers reported with each next call
+        difficulty = None
+        if body.get('adaptive'):
+            try:
+                difficulty = int(body.get('difficulty') or START_DIFFICULTY)
+            except (TypeError, ValueError):
+                abort(400)
+            if difficulty not in DIFFICULTIES:
+                abort(400)
+
+        session = quiz_sessions.start(category_id, difficulty)
+        return jsonify(
+            {
+                'success': True,
+                'session_id': session.id,
+                'difficulty': session.difficulty
+            }
+        )
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    @rate_limiter.limit('quiz')
+    @admission
+    @read_replica
+    def next_quiz_question(session_id):
+        '''
+        Next random question of a quiz session, null once all are played,
+        or the next count questions with a count
+        '''
+        session = quiz_sessions.get(session_id)
+        if session is None:
+            abort(404)
+
+        body = json_object(request)
+        # the result of the previous question counts towards the score
+        # of the session and moves an adaptive session, once per question
+        if body.get('correct') is not None:
+            if not isinstance(body['correct'], bool):
+                abort(400)
+            if not quiz_sessions.answer(session, body['correct']):
+                abort(422)
+
+        if body.get('count') is not None:
+            try:
+                count = min(max(int(body['count']), 1), MAX_PREFETCH)
+            except (TypeError, ValueError):
+                abort(400)
+            questions = quiz_sessions.next_questions(session, count)
+            return jsonify(
+                {
+                    'success': True,
+                    'questions': [question.format() for question in questions],
+                    'played': len(session.seen),
+                    'difficulty': session.difficulty
+                }
+            )
+
+        question = quiz_sessions.next_question(session)
+        return jsonify(
+            {
+                'success': True,
+                'question': question.format() if question else None,
+                'played': len(session.seen),
+                'difficulty': session.difficulty
+            }
+        )
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        '''
+        End a quiz session and free its state
+        '''
+        if not quiz_sessions.end(session_id):
+            abort(404)
+
+        return jsonify(
+            {
+                'success': True,
+                'deleted': session_id
+            }
+        )
+
+    # leaderboard: scores are buffered and written in batches, the best
+    # ones are served from memory
+    @app.route('/scores', methods=['POST'])
+    @rate_limiter.limit('score')
+    def submit_score():
+        '''
+        POST the score of a player, or the score of a quiz session
+        '''
+        body = json_object(request)
+        player = body.get('player')
+        if not isinstance(player, str) or not player.strip() or len(player) > MAX_PLAYER_LENGTH:
+            abort(400)
+
+        session_id = body.get('session_id')
+        if session_id is not None:
+            if not isinstance(session_id, str):
+                abort(400)
+            # the session ends with its score, so it is only counted once
+            session = quiz_sessions.get(session_id)
+            if session is None or not quiz_sessions.end(session_id):
+                abort(404)
+            score, category_id = session.correct, session.category
+        else:
+            try:
+                score = int(body.get('score'))
+                category_id = int(body.get('category') or 0)
+            except (TypeError, ValueError):
+                abort(400)
+            if score < 0:
+                abort(400)
+            if category_id and category_catalog.type(category_id) is None:
+                abort(422)
+
+        rank = leaderboard.submit(player.strip(), score, category_id)
+        return jsonify(
+            {
+                'success': True,
+                'score': score,
+                'rank': rank
+            }
+        )
+
+    @app.route('/leaderboard')
+    def retrieve_leaderboard():
+        '''
+        GET the best scores of a category (?category=, 0 or none for all)
+        '''
+        category_id = request.args.get('category', 0, type=int)
+        size = app.config['LEADERBOARD_SIZE']
+        limit = request.args.get('limit', min(10, size), type=int)
+        if limit < 1 or limit > size:
+            abort(400)
+
+        return jsonify(
+            {
+                'success': True,
+                'category': category_id,
+                'scores': leaderboard.top(category_id, limit)
+            }
+        )
+
+    @app.route('/metrics')
+    def metrics():
+        '''
+        GET request metrics, pool and response cache stats in the
+        Prometheus text format
+        '''
+        if not app.config['METRICS_ENABLED']:
+            abort(404)
+
+        return app.response_class(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -359,6 +863,22 @@ def create_app(test_config=None):
             422
         )
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({'success': False,
+                            'error': 429,
+                            'message': 'too many requests'})
+        response.headers['Retry-After'] = str(error.retry_after or 1)
+        return response, 429
+
+    @app.errorhandler(503)
+    def unavailable(error):
+        response = jsonify({'success': False,
+                            'error': 503,
+                            'message': 'service unavailable'})
+        response.headers['Retry-After'] = str(getattr(error, 'retry_after', None) or 1)
+        return response, 503
+
     @app.errorhandler(500)
     def server_error(error):
         return (
@@ -367,4 +887,7 @@ def create_app(test_config=None):
                      'message': 'Internal Server error'}),
             500
         )
-    return app
\ No newline at end of file
+
+    profile.mark('routes')
+    app.logger.debug('startup profile:\n%s', profile.report())
+    return app
@@ -0,0 +1,327 @@
+"""
+Async (ASGI) serving mode: the same trivia API on Quart with an async
+SQLAlchemy engine (asyncpg on Postgres, aiosqlite on SQLite), so a
+worker waits on the database without holding a thread per request.
+
+    hypercorn 'flaskr.asgi:create_async_app()'
+
+create_app() in flaskr stays the synchronous WSGI app. Tenants are
+resolved from the same header and scoped the same way, but all of them
+are served from ASYNC_DATABASE_URI: tenant shards are not routed here.
+"""
+import os
+
+from quart import Quart, request, abort, jsonify
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+import models
+from models import Question, Category, question_columns, format_row, notify_question_write, current_tenant, tenant_context, DEFAULT_TENANT
+from .quiz import quiz_sampler, MAX_PREFETCH
+from .tenants import TENANT_PATTERN
+
+QUESTIONS_PER_PAGE = 10
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(database_path):
+    '''
+    the database URL with the async driver of its backend
+    '''
+    url = make_url(database_path)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+async def paginate_questions(connection, statement):
+    '''
+    async counterpart of flaskr.paginate_questions for a select of
+    question_columns() ordered by Question.id
+    '''
+    after_id = request.args.get("after_id", None, type=int)
+    if after_id is not None:
+        statement = statement.where(Question.id > after_id)
+    else:
+        page = request.args.get("page", 1, type=int)
+        if page < 1:
+            return [], None
+        statement = statement.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    rows = (await connection.execute(statement.limit(QUESTIONS_PER_PAGE + 1))).all()
+    next_cursor = None
+    if len(rows) > QUESTIONS_PER_PAGE:
+        next_cursor = rows[QUESTIONS_PER_PAGE - 1].id
+    return [format_row(row) for row in rows[:QUESTIONS_PER_PAGE]], next_cursor
+
+
+def in_tenant():
+    return Question.tenant == current_tenant()
+
+
+async def fetch_categories(connection):
+    rows = await connection.execute(
+        select(Category.id, Category.type).where(Category.tenant == current_tenant()).order_by(Category.id)
+    )
+    return {id: type for id, type in rows}
+
+
+async def count_questions(connection, *criteria):
+    return (await connection.execute(select(func.count(Question.id)).where(in_tenant(), *criteria))).scalar()
+
+
+def create_async_app(test_config=None):
+    models.load_env()
+    app = Quart(__name__)
+    app.config.from_mapping(
+        ASYNC_DATABASE_URI=os.getenv('ASYNC_DATABASE_URI') or str(async_url(models.default_database_path())),
+        ASYNC_POOL_SIZE=int(os.getenv('ASYNC_POOL_SIZE', 20)),
+        TENANT_HEADER=os.getenv('TENANT_HEADER', 'X-Tenant'),
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    url = make_url(app.config['ASYNC_DATABASE_URI'])
+    # the DB_POOL_PROFILE and DB_* settings of the sync app, with a pool
+    # sized for the many requests one async worker serves at once
+    options = models.engine_options(app, url)
+    if url.get_backend_name() != 'sqlite' and options.get('poolclass') is not NullPool:
+        options['pool_size'] = app.config['ASYNC_POOL_SIZE']
+    engine = create_async_engine(url, **options)
+    app.extensions['async_engine'] = engine
+
+    @app.after_serving
+    async def dispose_engine():
+        await engine.dispose()
+
+    @app.before_request
+    async def resolve_tenant():
+        tenant = request.headers.get(app.config['TENANT_HEADER']) or DEFAULT_TENANT
+        if not TENANT_PATTERN.match(tenant):
+            abort(400)
+        tenant_context.set(tenant)
+
+    @app.after_request
+    async def after_request(response):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers.add(
+            'Access-Control-Allow-Headers', 'Content-Type,Authorization,true'
+        )
+        response.headers.add(
+            'Access-Control-Allow-Methods', 'GET,POST,DELETE,PATCH,PUT'
+        )
+        return response
+
+    @app.route('/categories')
+    async def retrieve_categories():
+        async with engine.connect() as connection:
+            categories = await fetch_categories(connection)
+        if len(categories) == 0:
+            abort(405)
+
+        return jsonify(
+            {
+                'success': True,
+                'categories': categories,
+                'total_categories': len(categories)
+            }
+        )
+
+    @app.route('/questions')
+    async def retrieve_questions():
+        statement = select(*question_columns()).where(in_tenant()).order_by(Question.id)
+        async with engine.connect() as connection:
+            questions, next_cursor = await paginate_questions(connection, statement)
+            if len(questions) == 0:
+                abort(404)
+            total_questions = await count_questions(connection)
+            categories = await fetch_categories(connection)
+
+        return jsonify(
+            {
+                'success': True,
+                'questions': questions,
+                'total_questions': total_questions,
+                'next_cursor': next_cursor,
+                'categories': categories
+            }
+        )
+
+    @app.route('/questions/<int:id>', methods=['DELETE'])
+    async def delete_question(id):
+        async with engine.begin() as connection:
+            row = (await connection.execute(
+                Question.__table__.delete().where(Question.id == id, in_tenant()).returning(*question_columns())
+            )).first()
+        if row is None:
+            abort(422)
+
+        notify_question_write('delete', format_row(row))
+        return jsonify(
+            {
+                'success': True,
+                'deleted': id
+            }
+        )
+
+    @app.route('/questions', methods=['POST'])
+    async def create_question():
+        body = await request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        try:
+            category = int(body.get('category'))
+        except (TypeError, ValueError):
+            abort(422)
+        async with engine.connect() as connection:
+            # the category has to be one of the tenant's own categories
+            if category not in await fetch_categories(connection):
+                abort(422)
+
+        try:
+            async with engine.begin() as connection:
+                row = (await connection.execute(
+                    Question.__table__.insert().values(
+                        question=body.get('question'),
+                        answer=body.get('answer'),
+                        difficulty=body.get('difficulty'),
+                        category=category,
+                        tenant=current_tenant()
+                    ).returning(*question_columns())
+                )).first()
+        except Exception:
+            abort(405)
+
+        notify_question_write('insert', format_row(row))
+        return jsonify(
+            {
+                'success': True,
+                'created': row.id
+            }
+        )
+
+    @app.route('/questions/search', methods=['POST'])
+    async def search_questions():
+        body = await request.get_json(silent=True) or {}
+        searchTerm = body.get('searchTerm', None) if isinstance(body, dict) else None
+        if not isinstance(searchTerm, str) or not searchTerm.strip():
+            abort(400)
+
+        escaped = searchTerm.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        match = Question.question.ilike(f'%{escaped}%', escape='\\')
+        statement = select(*question_columns()).where(in_tenant(), match).order_by(Question.id)
+        async with engine.connect() as connection:
+            questions, next_cursor = await paginate_questions(connection, statement)
+            total_questions = await count_questions(connection, match)
+
+        result = {
+            'success': True,
+            'questions': questions,
+            'total_questions': total_questions
+        }
+        # like the sync app, numbered pages have no cursor
+        if request.args.get('after_id') is not None:
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
+
+    @app.route('/categories/<int:id>/questions', methods=['GET'])
+    async def categorised_questions(id):
+        async with engine.connect() as connection:
+            categories = await fetch_categories(connection)
+            if id not in categories:
+                abort(422)
+            statement = select(*question_columns()).where(in_tenant(), Question.category == id).order_by(Question.id)
+            questions, next_cursor = await paginate_questions(connection, statement)
+            total_questions = await count_questions(connection, Question.category == id)
+
+        return jsonify(
+            {
+                'success': True,
+                'questions': questions,
+                'total_questions': total_questions,
+                'next_cursor': next_cursor,
+                'current_category': categories[id]
+            }
+        )
+
+    @app.route('/quizzes', methods=['POST'])
+    async def quiz_game():
+        body = await request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            abort(404)
+        previous_questions = body.get('previous_questions', None)
+        quiz_category = body.get('quiz_category', None)
+        if isinstance(quiz_category, dict):
+            quiz_category = quiz_category.get('id')
+        try:
+            category_id = int(quiz_category or 0)
+            seen = set(previous_questions)
+            count = body.get('count', None)
+            if count is not None:
+                count = min(max(int(count), 1), MAX_PREFETCH)
+        except (TypeError, ValueError):
+            abort(404)
+
+        async with engine.connect() as connection:
+            for _ in range(2):
+                # the id index is shared with the sync app's QuizSampler
+                ids = quiz_sampler.cached_ids(category_id)
+                if ids is None:
+                    statement = select(Question.id).where(in_tenant()).order_by(Question.id)
+                    if category_id:
+                        statement = statement.where(Question.category == category_id)
+                    ids = quiz_sampler.store_ids(category_id, await connection.scalars(statement))
+
+                drawn = quiz_sampler.draw_many(category_id, seen, count or 1, ids=ids)
+                rows = (await connection.execute(
+                    select(*question_columns()).where(in_tenant(), Question.id.in_(drawn))
+                )).all() if drawn else []
+                if len(rows) == len(drawn):
+                    break
+                # ids deleted by another process: reload the index and draw again
+                quiz_sampler.forget(category_id)
+
+        found = {row.id: format_row(row) for row in rows}
+        questions = [found[id] for id in drawn if id in found]
+        if count is not None:
+            return jsonify(
+                {
+                    'success': True,
+                    'questions': questions
+                }
+            )
+        if not questions:
+            abort(404)
+
+        return jsonify(
+            {
+                'success': True,
+                'question': questions[0]
+            }
+        )
+
+    @app.errorhandler(400)
+    async def bad_request(error):
+        return jsonify({'success': False, 'error': 400, 'message': 'bad request'}), 400
+
+    @app.errorhandler(404)
+    async def not_found(error):
+        return jsonify({'success': False, 'error': 404, 'message': 'resource not found'}), 404
+
+    @app.errorhandler(405)
+    async def not_allowed(error):
+        return jsonify({'success': False, 'error': 405, 'message': 'method not allowed'}), 405
+
+    @app.errorhandler(422)
+    async def unprocessable(error):
+        return jsonify({'success': False, 'error': 422, 'message': 'request unprocessable'}), 422
+
+    @app.errorhandler(500)
+    async def server_error(error):
+        return jsonify({'success': False, 'error': 500, 'message': 'Internal Server error'}), 500
+
+    return app
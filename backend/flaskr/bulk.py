@@ -0,0 +1,317 @@
+import csv
+import io
+import json
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, notify_question_write, question_columns, format_row, QUESTION_FIELDS, DEFAULT_TENANT
+from .categories import category_catalog
+
+# per-row errors reported back, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def text_lines(stream):
+    '''
+    decoded lines of a binary stream, read through a buffer
+    '''
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def read_ndjson(lines):
+    '''
+    (line number, row or error) for each non-blank line of NDJSON
+    '''
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, 'invalid json'
+            continue
+        if not isinstance(row, dict):
+            yield number, 'expected a json object'
+            continue
+        yield number, row
+
+
+def read_csv(lines):
+    '''
+    (line number, row or error) for each CSV record after the header
+    '''
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def validate(row):
+    '''
+    cleaned column values of a question row, or an error message
+    '''
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return f'{field} is required'
+        values[field] = value
+
+    for field in ('category', 'difficulty'):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            return f'{field} must be an integer'
+
+    if category_catalog.type(values['category']) is None:
+        return 'unknown category'
+    if not 1 <= values['difficulty'] <= 5:
+        return 'difficulty must be between 1 and 5'
+    return values
+
+
+def import_questions(records, batch_size=1000):
+    '''
+    Validates (line number, row) records and inserts the valid rows,
+    batch_size rows per INSERT and commit. Returns the number of questions
+    inserted and the errors as [{'line': ..., 'error': ...}].
+    '''
+    inserted = 0
+    errors = []
+    error_count = 0
+    batch = []
+    batch_lines = []
+
+    def error(line, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line, 'error': message})
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        try:
+            # one executemany INSERT and one commit for the whole batch
+            db.session.execute(Question.__table__.insert(), batch)
+            db.session.commit()
+            inserted += len(batch)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            for line in batch_lines:
+                error(line, 'batch failed: {}'.format(e.__class__.__name__))
+        batch.clear()
+        batch_lines.clear()
+
+    try:
+        for line, row in records:
+            values = row if isinstance(row, str) else validate(row)
+            if isinstance(values, str):
+                error(line, values)
+                continue
+            batch.append(values)
+            batch_lines.append(line)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if inserted:
+            # caches and indexes are refreshed once, not per row
+            notify_question_write('insert')
+
+    return inserted, errors, error_count
+
+
+# question columns a bulk change may filter on and set
+BULK_FIELDS = ('category', 'difficulty')
+
+
+def validate_changes(values):
+    '''
+    cleaned column values for a bulk update, or an error message
+    '''
+    if not isinstance(values, dict) or not values:
+        return 'set is required'
+    changes = {}
+    for field, value in values.items():
+        if field not in BULK_FIELDS:
+            return f'{field} cannot be changed in bulk'
+        try:
+            changes[field] = int(value)
+        except (TypeError, ValueError):
+            return f'{field} must be an integer'
+
+    if 'category' in changes and category_catalog.type(changes['category']) is None:
+        return 'unknown category'
+    if 'difficulty' in changes and not 1 <= changes['difficulty'] <= 5:
+        return 'difficulty must be between 1 and 5'
+    return changes
+
+
+def select_questions(body):
+    '''
+    (ids, criteria) of the questions a bulk change applies to, from
+    {"ids": [...]} or {"filter": {"category": ..., "difficulty": ...}},
+    or an error message. An empty filter is refused rather than taken
+    as every question.
+    '''
+    ids = body.get('ids')
+    filters = body.get('filter')
+    if (ids is None) == (filters is None):
+        return 'either ids or filter is required'
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            return 'ids must be a non-empty list'
+        try:
+            return sorted({int(id) for id in ids}), None
+        except (TypeError, ValueError):
+            return 'ids must be integers'
+
+    if not isinstance(filters, dict) or not filters:
+        return 'filter must name category or difficulty'
+    criteria = []
+    for field, value in filters.items():
+        if field not in BULK_FIELDS:
+            return f'cannot filter on {field}'
+        try:
+            criteria.append(getattr(Question, field) == int(value))
+        except (TypeError, ValueError):
+            return f'{field} must be an integer'
+    return None, criteria
+
+
+def id_batches(ids, criteria, batch_size):
+    '''
+    the question ids to change, batch_size at a time: slices of ids, or
+    the ids matching criteria read page by page in id order
+    '''
+    if ids is not None:
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size]
+        return
+
+    after_id = None
+    while True:
+        query = select(Question.id).where(*criteria).order_by(Question.id).limit(batch_size)
+        if after_id is not None:
+            query = query.where(Question.id > after_id)
+        batch = db.session.scalars(query).all()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]
+
+
+def change_questions(action, ids=None, criteria=None, values=None, batch_size=1000):
+    '''
+    Deletes (action 'delete') or sets values on (action 'update') the
+    questions of ids or matching criteria, with one DELETE or UPDATE ...
+    WHERE id IN (...) and one commit per batch of batch_size questions.
+    Returns the number of questions changed. Caches and counts are
+    refreshed once at the end, also when a batch failed.
+    '''
+    changed = 0
+    try:
+        for batch in id_batches(ids, criteria, batch_size):
+            if action == 'delete':
+                statement = delete(Question).where(Question.id.in_(batch))
+            else:
+                statement = update(Question).where(Question.id.in_(batch)).values(**values)
+            # the tenant criteria is added to the statement like to selects
+            result = db.session.execute(statement, execution_options={'synchronize_session': False})
+            db.session.commit()
+            changed += result.rowcount
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    finally:
+        if changed:
+            notify_question_write(action)
+
+    return changed
+
+
+def wants_stream(request):
+    '''
+    True for listings requested with ?stream=1 or Accept: application/x-ndjson
+    '''
+    if request.args.get('stream', 0, type=int) == 1:
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
+def export_questions(format='ndjson', batch_size=1000, selection=None):
+    '''
+    generator of the questions in selection (default: the whole table) as
+    NDJSON or CSV text in id order, read with a server-side cursor so only
+    batch_size rows are held at a time
+    '''
+    if selection is None:
+        selection = Question.query
+    rows = selection.with_entities(*question_columns()).order_by(None).order_by(Question.id).execution_options(
+        yield_per=batch_size
+    )
+
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(QUESTION_FIELDS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        for row in rows:
+            yield current_app.json.dumps(format_row(row)) + '\n'
+
+
+@click.command('import-questions')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='defaults to csv for .csv files, ndjson otherwise')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--tenant', default=DEFAULT_TENANT, show_default=True)
+@with_appcontext
+def import_questions_command(file, format, batch_size, tenant):
+    '''Import questions from an NDJSON or CSV file ("-" for stdin).'''
+    g.tenant = tenant
+    if format is None:
+        format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+    lines = text_lines(file)
+    records = read_csv(lines) if format == 'csv' else read_ndjson(lines)
+
+    inserted, errors, error_count = import_questions(records, batch_size)
+    for error in errors:
+        click.echo('line {line}: {error}'.format(**error), err=True)
+    click.echo(f'{inserted} questions imported, {error_count} rows rejected')
+
+
+@click.command('export-questions')
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--tenant', default=DEFAULT_TENANT, show_default=True)
+@with_appcontext
+def export_questions_command(file, format, tenant):
+    '''Export all questions of a tenant as NDJSON or CSV to a file ("-" for stdout).'''
+    g.tenant = tenant
+    for chunk in export_questions(format):
+        file.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(export_questions_command)
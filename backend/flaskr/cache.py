@@ -0,0 +1,198 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, request
+from sqlalchemy import event
+
+from models import Category, question_listeners, current_tenant
+from .bulk import wants_stream
+from .compression import compressor
+from .replicas import sticky
+
+
+def entry_size(entry):
+    return len(entry['body']) + sum(len(data) for data in entry.get('encoded', {}).values())
+
+
+"""
+MemoryCacheBackend
+    in-process LRU store for cached responses, capped at max_bytes of
+    response bodies, with a version counter per namespace (tenant).
+    Entries set with a ttl expire that many seconds later, on read. A
+    shared backend (e.g. on redis or memcached) needs the same
+    get/set/version/bump_version/bumped_at methods, with values pickled.
+"""
+class MemoryCacheBackend:
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bumped = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self.size -= entry_size(entry)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl=None):
+        size = entry_size(entry)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= entry_size(old[0])
+            self._entries[key] = (entry, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= entry_size(evicted)
+                self.evictions += 1
+
+    def version(self, namespace=None):
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace=None):
+        # old entries can no longer be looked up and age out of the LRU
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self._bumped[namespace] = time.time()
+
+    def bumped_at(self, namespace=None):
+        '''
+        time of the last bump_version of namespace, 0 if never bumped
+        '''
+        return self._bumped.get(namespace, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+"""
+ResponseCache
+    caches whole GET responses keyed on tenant, path and query string.
+    Keys carry a version counter per tenant bumped on every question
+    write (and category change), so a write invalidates every cached page
+    of its tenant at once. Bodies are
+    stored with their compressed encodings, served as negotiated.
+    Entries also expire RESPONSE_CACHE_TTL seconds after they are stored,
+    which bounds how long a page can miss the writes of other workers.
+    Clients that read their own writes from the primary bypass the cache,
+    and a page read from a replica within DB_REPLICA_STICKY_SECONDS of a
+    write is not stored, as the replica may not have the write yet.
+"""
+class ResponseCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.enabled = True
+        self.ttl = None
+        self.replica_lag = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.enabled = app.config['RESPONSE_CACHE_ENABLED']
+        self.ttl = app.config['RESPONSE_CACHE_TTL'] or None
+        self.replica_lag = int(app.config['DB_REPLICA_STICKY_SECONDS'])
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        if backend is None:
+            backend = MemoryCacheBackend(max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, *args):
+        self.backend.bump_version(current_tenant())
+
+    def invalidate_category(self, mapper, connection, target):
+        self.backend.bump_version(target.tenant)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': getattr(self.backend, 'evictions', 0),
+            'bytes': getattr(self.backend, 'size', 0)
+        }
+
+    def cached(self, view):
+        '''
+        decorator for GET views whose response only depends on the database
+        '''
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or request.method != 'GET' or wants_stream(request) or sticky():
+                return view(*args, **kwargs)
+
+            tenant = current_tenant()
+            key = '{}:{}:{}'.format(tenant, self.backend.version(tenant), request.full_path)
+            entry = self.backend.get(key)
+            if entry is not None:
+                self.hits += 1
+                return self.respond(entry, 'HIT')
+
+            self.misses += 1
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed or self.stale_replica_read(tenant):
+                response.headers['X-Cache'] = 'MISS'
+                return response
+
+            body = response.get_data()
+            entry = {
+                'status': response.status_code,
+                'headers': list(response.headers.items()),
+                'body': body,
+                'encoded': compressor.encode_all(body) if compressor.compressible(response) else {}
+            }
+            self.backend.set(key, entry, ttl=self.ttl)
+            return self.respond(entry, 'MISS')
+
+        return wrapper
+
+    def stale_replica_read(self, tenant):
+        '''
+        whether the response was read from a replica that may still lag
+        behind the last write of tenant
+        '''
+        if not g.get('replica_engine'):
+            return False
+        return self.backend.bumped_at(tenant) + self.replica_lag > time.time()
+
+    def respond(self, entry, status):
+        '''
+        response of a cache entry, in the encoding negotiated with the client
+        '''
+        encoded = entry.get('encoded') or {}
+        encoding = compressor.negotiate() if encoded else None
+        response = current_app.response_class(
+            encoded.get(encoding, entry['body']), status=entry['status'], headers=entry['headers']
+        )
+        if encoded:
+            response.vary.add('Accept-Encoding')
+        if encoding in encoded:
+            compressor.encoded(response, encoding)
+        response.headers['X-Cache'] = status
+        return response.make_conditional(request)
+
+
+response_cache = ResponseCache()
+question_listeners.append(response_cache.invalidate)
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, response_cache.invalidate_category)
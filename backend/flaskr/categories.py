@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from models import db, Category, current_tenant, primary, DEFAULT_TENANT
+
+"""
+CategoryCatalog
+    process-level cache of the categories of each tenant: the {id: type}
+    dict the frontend expects, plus the /categories response body
+    serialized once with its ETag. Reloaded after invalidate() (called on
+    any Category insert/update/delete through the ORM) or after ttl
+    seconds, for changes made outside this process.
+"""
+class CategoryCatalog:
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['CATEGORY_CACHE_TTL']
+        self.invalidate()
+        app.cli.add_command(create_categories_command)
+
+    def invalidate(self, mapper=None, connection=None, target=None):
+        '''
+        drops the categories of the tenant of target, of all tenants without
+        '''
+        with self._lock:
+            if target is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(target.tenant, None)
+
+    def _load(self):
+        tenant = current_tenant()
+        entry = self._entries.get(tenant)
+        if entry is not None and entry['expires'] > time.monotonic():
+            return entry
+
+        with primary():
+            rows = db.session.query(Category.id, Category.type).order_by(Category.id).all()
+        categories = {id: type for id, type in rows}
+        body = current_app.json.dumps(
+            {
+                'success': True,
+                'categories': categories,
+                'total_categories': len(categories)
+            }
+        ).encode()
+        entry = {
+            'categories': categories,
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'expires': time.monotonic() + self.ttl
+        }
+        with self._lock:
+            self._entries[tenant] = entry
+        return entry
+
+    def categories(self):
+        '''
+        {category.id: category.type} for all categories
+        '''
+        return self._load()['categories']
+
+    def type(self, id):
+        '''
+        category.type of a category id, None if there is no such category
+        '''
+        return self._load()['categories'].get(id)
+
+    def body(self):
+        '''
+        serialized /categories response and its ETag
+        '''
+        entry = self._load()
+        return entry['body'], entry['etag']
+
+
+category_catalog = CategoryCatalog()
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, category_catalog.invalidate)
+
+
+@click.command('create-categories')
+@click.argument('types', nargs=-1, required=True)
+@click.option('--tenant', default=DEFAULT_TENANT, show_default=True)
+@with_appcontext
+def create_categories_command(types, tenant):
+    '''Create categories of a tenant, skipping the ones it already has.'''
+    g.tenant = tenant
+    existing = {type: id for id, type in category_catalog.categories().items()}
+    for type in types:
+        if type not in existing:
+            category = Category(type=type)
+            category.insert()
+            existing[type] = category.id
+        click.echo('{}\t{}'.format(existing[type], type))
+
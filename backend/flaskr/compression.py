@@ -0,0 +1,125 @@
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+BROTLI_QUALITY = 5
+
+
+"""
+Compressor
+    gzip (and brotli, when installed) response compression negotiated on
+    Accept-Encoding, for text responses of at least min_size bytes.
+    Streamed responses are compressed chunk by chunk. Responses cached
+    by ResponseCache are stored with their encodings ready (encode_all),
+    so a cache hit is not compressed again.
+"""
+class Compressor:
+
+    def __init__(self, min_size=1024, level=6):
+        self.enabled = True
+        self.min_size = min_size
+        self.level = level
+
+    def init_app(self, app):
+        self.enabled = app.config['COMPRESSION_ENABLED']
+        self.min_size = app.config['COMPRESSION_MIN_SIZE']
+        self.level = app.config['COMPRESSION_LEVEL']
+        app.after_request(self.compress)
+
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def negotiate(self):
+        '''
+        the encoding the client prefers among the supported ones, None for
+        identity
+        '''
+        if not self.enabled:
+            return None
+        best, best_quality = None, 0
+        for encoding in self.encodings():
+            quality = request.accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def encode(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def encode_all(self, data):
+        '''
+        {encoding: compressed data} of a body worth compressing, for caching
+        '''
+        if not self.enabled or len(data) < self.min_size:
+            return {}
+        return {encoding: self.encode(data, encoding) for encoding in self.encodings()}
+
+    def compressible(self, response):
+        return (
+            200 <= response.status_code < 300
+            and response.status_code != 204
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and 'Content-Encoding' not in response.headers
+        )
+
+    def encoded(self, response, encoding):
+        '''
+        marks response as encoded: the ETag of the identity body is kept,
+        weakened, as the bytes sent now differ
+        '''
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def compress(self, response):
+        if not self.enabled or request.method == 'HEAD' or not self.compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.stream(response.response, encoding)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+            return self.encoded(response, encoding)
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(self.encode(data, encoding))
+        return self.encoded(response, encoding)
+
+    def stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            compress, flush = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, flush = compressor.compress, compressor.flush
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                data = compress(chunk)
+                if data:
+                    yield data
+            yield flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+compressor = Compressor()
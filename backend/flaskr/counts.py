@@ -0,0 +1,104 @@
+import threading
+import time
+from sqlalchemy import func, or_, text
+
+from models import db, Question, question_listeners, current_tenant, primary
+
+"""
+QuestionCounter
+    question totals for the listing endpoints, using SELECT COUNT(*)
+    instead of loading the rows. Counts are kept per tenant and category
+    (None is the category key for all questions) and adjusted on every
+    Question.insert()/delete(); the ttl bounds how stale they can get
+    when other workers write to the same database.
+"""
+class QuestionCounter:
+
+    def __init__(self, ttl=60, approximate=False):
+        self.ttl = ttl
+        self.approximate = approximate
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['QUESTION_COUNT_TTL']
+        self.approximate = app.config['QUESTION_COUNT_MODE'] == 'approximate'
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def total(self, category=None):
+        '''
+        number of questions in category, or of all questions for None
+        '''
+        category = None if category is None else int(category)
+        key = (current_tenant(), category)
+        now = time.monotonic()
+        cached = self._counts.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        with primary():
+            count = self._count(category)
+        with self._lock:
+            self._counts[key] = (count, now + self.ttl)
+        return count
+
+    def _count(self, category):
+        if category is None and self.approximate:
+            estimate = self._estimate()
+            if estimate is not None:
+                return estimate
+
+        query = db.session.query(func.count(Question.id))
+        if category is not None:
+            query = query.filter(Question.category == category)
+        return query.scalar()
+
+    def _single_tenant(self):
+        '''
+        whether the questions table holds no rows of other tenants, so
+        the estimate of the table is the count of the current tenant;
+        two range scans of the (tenant, id) index
+        '''
+        tenant = current_tenant()
+        other = db.session.query(Question.id).execution_options(all_tenants=True).filter(
+            or_(Question.tenant < tenant, Question.tenant > tenant)
+        ).limit(1).first()
+        return other is None
+
+    def _estimate(self):
+        # planner statistics: no table scan, but only as fresh as the last
+        # ANALYZE/autovacuum. reltuples is -1 for a never analyzed table.
+        if db.engine.dialect.name != 'postgresql' or not self._single_tenant():
+            return None
+        estimate = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'questions'")
+        ).scalar()
+        if estimate is None or estimate < 0:
+            return None
+        return estimate
+
+    def on_question_write(self, action, record):
+        with self._lock:
+            tenant = current_tenant()
+            if record is None or action == 'update':
+                # a question may have changed category, recount on next read
+                for key in [key for key in self._counts if key[0] == tenant]:
+                    del self._counts[key]
+                return
+
+            delta = 1 if action == 'insert' else -1
+            keys = [(tenant, None)]
+            if record['category'] is not None:
+                keys.append((tenant, int(record['category'])))
+            for key in keys:
+                if key in self._counts:
+                    count, expires = self._counts[key]
+                    self._counts[key] = (count + delta, expires)
+
+
+question_counter = QuestionCounter()
+question_listeners.append(question_counter.on_question_write)
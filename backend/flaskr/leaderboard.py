@@ -0,0 +1,219 @@
+import atexit
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Score, current_tenant
+
+logger = logging.getLogger(__name__)
+
+# longest player name accepted
+MAX_PLAYER_LENGTH = 64
+# buffered scores kept while the database cannot take them, in flushes
+MAX_BUFFERED_FLUSHES = 20
+
+
+"""
+TopScores
+    the best size scores of one tenant and category as a min-heap: a new
+    score replaces the lowest one in O(log size), reads sort the few
+    entries once until the next change. On equal scores the earlier one
+    ranks first.
+"""
+class TopScores:
+
+    def __init__(self, size, expires):
+        self.size = size
+        self.expires = expires
+        self._heap = []
+        self._ranked = None
+
+    def push(self, entry, submitted):
+        '''
+        adds entry (scored at the submitted timestamp), returns whether
+        it made the board
+        '''
+        item = (entry['score'], -submitted, id(entry), entry)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+        else:
+            return False
+        self._ranked = None
+        return True
+
+    def ranked(self):
+        if self._ranked is None:
+            self._ranked = [item[3] for item in sorted(self._heap, reverse=True)]
+        return self._ranked
+
+
+"""
+Leaderboard
+    score submission and the top scores per tenant and category (0 for
+    every category). New scores go to an in-process buffer, written with
+    one executemany INSERT per tenant once SCORE_FLUSH_SIZE scores are
+    waiting or every SCORE_FLUSH_INTERVAL seconds, by a background thread.
+    Reads are served from TopScores kept up to date on every submission;
+    a board is loaded with one indexed ORDER BY score DESC LIMIT query
+    and reloaded after LEADERBOARD_TTL seconds to pick up the scores of
+    other workers.
+"""
+class Leaderboard:
+
+    def __init__(self, size=100, ttl=60, flush_size=500, flush_interval=5):
+        self.size = size
+        self.ttl = ttl
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._boards = {}
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._app = None
+
+    def init_app(self, app):
+        self.size = app.config['LEADERBOARD_SIZE']
+        self.ttl = app.config['LEADERBOARD_TTL']
+        self.flush_size = app.config['SCORE_FLUSH_SIZE']
+        self.flush_interval = app.config['SCORE_FLUSH_INTERVAL']
+        with self._lock:
+            self._boards.clear()
+
+    def board(self, category=0):
+        '''
+        TopScores of category for the current tenant, loaded on first use
+        '''
+        key = (current_tenant(), category)
+        board = self._boards.get(key)
+        if board is not None and board.expires > time.monotonic():
+            return board
+
+        # scores of this worker are written first, so the reload has them
+        self.flush()
+        query = db.session.query(Score.player, Score.category, Score.score, Score.created_at)
+        if category:
+            query = query.filter(Score.category == category)
+        rows = query.order_by(Score.score.desc(), Score.created_at).limit(self.size)
+
+        board = TopScores(self.size, time.monotonic() + self.ttl)
+        for player, row_category, score, created_at in rows:
+            entry = {'player': player, 'category': row_category, 'score': score}
+            board.push(entry, created_at.timestamp())
+        with self._lock:
+            self._boards[key] = board
+        return board
+
+    def top(self, category=0, limit=10):
+        '''
+        the best limit scores of category, best first, with their rank
+        '''
+        ranked = self.board(category).ranked()[:limit]
+        return [dict(entry, rank=rank) for rank, entry in enumerate(ranked, start=1)]
+
+    def submit(self, player, score, category=0):
+        '''
+        records a score, returns its rank on the board of its category
+        (None when it did not make the top LEADERBOARD_SIZE)
+        '''
+        now = datetime.now(timezone.utc)
+        entry = {'player': player, 'category': category, 'score': score}
+        boards = [self.board(category)]
+        if category:
+            boards.append(self.board(0))
+
+        with self._lock:
+            self._buffer.append(dict(entry, tenant=current_tenant(), created_at=now))
+            for board in boards:
+                board.push(entry, now.timestamp())
+            full = len(self._buffer) >= self.flush_size
+        self.start_flusher()
+        if full:
+            self.flush()
+
+        ranked = boards[0].ranked()
+        return next((rank for rank, ranked_entry in enumerate(ranked, start=1) if ranked_entry is entry), None)
+
+    def buffered(self):
+        return len(self._buffer)
+
+    def flush(self):
+        '''
+        writes the buffered scores, one INSERT and commit per tenant.
+        Returns the number written; the scores of a failed insert stay
+        buffered for the next flush.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+
+            tenants = {}
+            for record in batch:
+                tenants.setdefault(record['tenant'], []).append(record)
+            written = 0
+            request_tenant = g.get('tenant')
+            try:
+                for tenant, records in tenants.items():
+                    # the tenant routes the insert to its shard
+                    g.tenant = tenant
+                    try:
+                        db.session.execute(Score.__table__.insert(), records)
+                        db.session.commit()
+                        written += len(records)
+                    except SQLAlchemyError:
+                        db.session.rollback()
+                        logger.exception('could not write %d scores of tenant %s', len(records), tenant)
+                        self.requeue(records)
+            finally:
+                if request_tenant is None:
+                    g.pop('tenant', None)
+                else:
+                    g.tenant = request_tenant
+            return written
+
+    def requeue(self, records):
+        with self._lock:
+            self._buffer[:0] = records
+            overflow = len(self._buffer) - self.flush_size * MAX_BUFFERED_FLUSHES
+            if overflow > 0:
+                logger.warning('dropping %d buffered scores', overflow)
+                del self._buffer[:overflow]
+
+    def start_flusher(self):
+        '''
+        starts the background flush of this process on first use, so that
+        each forked worker gets its own
+        '''
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._app = current_app._get_current_object()
+            self._flusher = threading.Thread(target=self.flush_periodically, args=(self._app,),
+                                             name='score-flush', daemon=True)
+            self._flusher.start()
+
+    def flush_periodically(self, app):
+        while True:
+            time.sleep(self.flush_interval)
+            with app.app_context():
+                self.flush()
+
+    def shutdown(self):
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+
+leaderboard = Leaderboard()
+atexit.register(leaderboard.shutdown)
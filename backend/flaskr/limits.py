@@ -0,0 +1,168 @@
+import functools
+import math
+import threading
+import time
+from flask import request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from models import current_tenant
+
+
+def parse_rate(value):
+    '''
+    (requests, seconds) of a 'requests/seconds' rate like '30/60'
+    '''
+    requests, seconds = str(value).split('/')
+    return int(requests), float(seconds)
+
+
+"""
+MemoryBucketStore
+    in-process token buckets, one per key. A shared store (e.g. redis with
+    a small script doing the same arithmetic atomically) needs the same
+    take(key, capacity, rate) method, through the RATE_LIMIT_STORE config.
+"""
+class MemoryBucketStore:
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        '''
+        takes a token from the bucket of key, which holds up to capacity
+        tokens and refills rate tokens a second. Returns 0 when a token
+        was taken, else the seconds until the next one.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, capacity / rate)
+            return 0
+
+    def _prune(self, now, refill_seconds):
+        # a bucket untouched for a full refill is full again, like a new one
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if now - updated >= refill_seconds:
+                del self._buckets[key]
+
+
+"""
+RateLimiter
+    token bucket rate limits per client address (and tenant) and per
+    named limit: RATE_LIMIT_<NAME> is 'requests/seconds', the bucket
+    holds a burst of requests and refills at requests/seconds. Requests
+    over the limit get a 429 with Retry-After.
+"""
+class RateLimiter:
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else MemoryBucketStore()
+        self.enabled = True
+        self.limits = {}
+
+    def init_app(self, app):
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        store = app.config.get('RATE_LIMIT_STORE')
+        self.store = store if store is not None else MemoryBucketStore()
+        self.limits = {
+            key[len('RATE_LIMIT_'):].lower(): parse_rate(value)
+            for key, value in app.config.items()
+            if key.startswith('RATE_LIMIT_') and key not in ('RATE_LIMIT_ENABLED', 'RATE_LIMIT_STORE')
+        }
+
+    def check(self, name):
+        if not self.enabled or name not in self.limits:
+            return
+        requests, seconds = self.limits[name]
+        key = '{}:{}:{}'.format(name, current_tenant(), request.remote_addr)
+        retry_after = self.store.take(key, requests, requests / seconds)
+        if retry_after:
+            raise TooManyRequests(retry_after=math.ceil(retry_after))
+
+    def limit(self, name):
+        '''
+        view decorator applying the RATE_LIMIT_<NAME> limit
+        '''
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                self.check(name)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+rate_limiter = RateLimiter()
+
+
+"""
+AdmissionGate
+    caps the expensive endpoints (search, quizzes, bulk import and changes)
+    at ADMISSION_LIMIT concurrent requests per worker, below the database
+    pool size, so they cannot take every connection. Up to ADMISSION_QUEUE
+    more wait at most ADMISSION_TIMEOUT seconds for a slot; the rest get
+    a 503 at once instead of queueing behind a saturated pool.
+"""
+class AdmissionGate:
+
+    def __init__(self, limit=8, queue=16, timeout=2.0):
+        self.configure(limit, queue, timeout)
+
+    def init_app(self, app):
+        self.configure(app.config['ADMISSION_LIMIT'], app.config['ADMISSION_QUEUE'],
+                       app.config['ADMISSION_TIMEOUT'])
+
+    def configure(self, limit, queue, timeout):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+        self._lock = threading.Lock()
+
+    def acquire(self, slots):
+        if slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+        try:
+            admitted = slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not admitted:
+            with self._lock:
+                self.rejected += 1
+        return admitted
+
+    def __call__(self, view):
+        '''
+        view decorator: runs the view in one of the slots, or answers 503
+        '''
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            slots = self._slots
+            if slots is None:
+                return view(*args, **kwargs)
+            if not self.acquire(slots):
+                raise ServiceUnavailable(retry_after=1)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                slots.release()
+        return wrapper
+
+
+admission = AdmissionGate()
@@ -0,0 +1,168 @@
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db, pool_metrics
+from .cache import response_cache
+from .search import question_search
+from .limits import admission
+from .leaderboard import leaderboard
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+
+"""
+Histogram
+    Prometheus-style histogram per label set: cumulative bucket
+    counts, sum and count
+"""
+class Histogram:
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + (('le', bound),)), count))
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + (('le', '+Inf'),)), series['count']))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), series['sum']))
+                lines.append('{}_count{} {}'.format(self.name, format_labels(labels), series['count']))
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+    return '{' + ','.join(values) + '}'
+
+
+def gauge(name, help, value, type='gauge'):
+    return ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, type), '{} {}'.format(name, value)]
+
+
+"""
+RequestMetrics
+    per route instrumentation: request latency, SQL query count and
+    time (from SQLAlchemy cursor events), rows fetched and response
+    bytes. Each request gets a Server-Timing header and /metrics
+    renders everything in the Prometheus text format.
+"""
+class RequestMetrics:
+
+    def __init__(self):
+        self.latency = Histogram('trivia_request_duration_seconds', 'request latency', LATENCY_BUCKETS)
+        self.queries = Histogram('trivia_sql_queries_per_request', 'SQL statements per request', QUERY_BUCKETS)
+        self.sql_time = Histogram('trivia_sql_duration_seconds', 'SQL time per request', LATENCY_BUCKETS)
+        self.rows = Histogram('trivia_sql_rows_per_request', 'rows returned by SQL per request', ROW_BUCKETS)
+        self.response_bytes = Histogram('trivia_response_bytes', 'response body size', BYTES_BUCKETS)
+
+    def init_app(self, app):
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g.metrics = {'start': time.perf_counter(), 'queries': 0, 'sql_time': 0.0, 'rows': 0}
+
+    def finish_request(self, response):
+        stats = g.get('metrics')
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats['start']
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+
+        self.latency.observe(labels + (('status', response.status_code),), duration)
+        self.queries.observe(labels, stats['queries'])
+        self.sql_time.observe(labels, stats['sql_time'])
+        self.rows.observe(labels, stats['rows'])
+        if response.content_length is not None:
+            self.response_bytes.observe(labels, response.content_length)
+
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries, {} rows"'.format(
+            stats['sql_time'] * 1000, stats['queries'], stats['rows']))
+        response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(duration * 1000))
+        return response
+
+    def render(self):
+        lines = []
+        for histogram in (self.latency, self.queries, self.sql_time, self.rows, self.response_bytes):
+            lines.extend(histogram.render())
+
+        cache = response_cache.stats()
+        lines.extend(gauge('trivia_response_cache_hits_total', 'response cache hits', cache['hits'], 'counter'))
+        lines.extend(gauge('trivia_response_cache_misses_total', 'response cache misses', cache['misses'], 'counter'))
+        lines.extend(gauge('trivia_response_cache_evictions_total', 'response cache evictions',
+                           cache['evictions'], 'counter'))
+        lines.extend(gauge('trivia_response_cache_bytes', 'bytes held by the response cache', cache['bytes']))
+
+        lines.extend(gauge('trivia_search_cache_hits_total', 'searches answered from the result cache',
+                           question_search.results.hits, 'counter'))
+        lines.extend(gauge('trivia_search_cache_misses_total', 'searches run against the index or database',
+                           question_search.results.misses, 'counter'))
+
+        lines.extend(gauge('trivia_admission_waiting', 'requests queued for an admission slot', admission.waiting))
+        lines.extend(gauge('trivia_admission_rejected_total', 'requests turned away with a 503',
+                           admission.rejected, 'counter'))
+        lines.extend(gauge('trivia_scores_buffered', 'scores waiting to be written', leaderboard.buffered()))
+
+        pool = pool_metrics.snapshot(db.engine.pool)
+        lines.extend(gauge('trivia_db_pool_checkouts_total', 'connection checkouts', pool['checkouts'], 'counter'))
+        lines.extend(gauge('trivia_db_pool_timeouts_total', 'checkouts that timed out', pool['timeouts'], 'counter'))
+        lines.extend(gauge('trivia_db_pool_wait_seconds_total', 'time spent waiting for a connection',
+                           pool['wait_seconds_total'], 'counter'))
+        lines.extend(gauge('trivia_db_pool_wait_seconds_max', 'longest wait for a connection', pool['wait_seconds_max']))
+        if 'saturation' in pool:
+            lines.extend(gauge('trivia_db_pool_checked_out', 'connections in use', pool['checked_out']))
+            lines.extend(gauge('trivia_db_pool_saturation', 'connections in use over pool capacity', pool['saturation']))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics' in g:
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None or not has_request_context():
+        return
+    stats = g.get('metrics')
+    if stats is None:
+        return
+    stats['queries'] += 1
+    stats['sql_time'] += time.perf_counter() - start
+    # rows of statements that return rows, as far as the driver knows
+    # them up front: psycopg2 does, sqlite3 and server-side cursors do not
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats['rows'] += cursor.rowcount
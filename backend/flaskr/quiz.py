@@ -0,0 +1,398 @@
+import bisect
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from models import db, Question, question_listeners, current_tenant, primary
+
+# random draws tried before falling back to a scan of the unseen ids
+MAX_DRAWS = 32
+# most questions returned by one prefetch
+MAX_PREFETCH = 50
+# question difficulties, and where adaptive sessions start
+DIFFICULTIES = (1, 2, 3, 4, 5)
+START_DIFFICULTY = 3
+# correct answers in a row that move an adaptive session one level up
+STREAK_UP = 2
+
+"""
+QuizSampler
+    picks random quiz questions from an in-memory index of question ids,
+    one array per tenant and category (category 0 holds every question
+    of the tenant), and for difficulty picks one array per tenant,
+    category and difficulty. An index is
+    loaded on first use with a single id-only query and dropped again
+    when a question of its category is inserted or deleted, or when its
+    ttl runs out.
+"""
+class QuizSampler:
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._index = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['QUIZ_INDEX_TTL']
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._buckets.clear()
+
+    def ids(self, category=0):
+        '''
+        array of the question ids in category, 0 for all categories
+        '''
+        ids = self.cached_ids(category)
+        if ids is not None:
+            return ids
+
+        query = db.session.query(Question.id)
+        if category:
+            query = query.filter(Question.category == category)
+        with primary():
+            return self.store_ids(category, (row[0] for row in query.order_by(Question.id)))
+
+    def cached_ids(self, category, tenant=None):
+        cached = self._index.get((tenant or current_tenant(), category))
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def store_ids(self, category, ids, tenant=None):
+        '''
+        index the ids of category, for callers that load them themselves
+        '''
+        ids = array('l', ids)
+        with self._lock:
+            self._index[(tenant or current_tenant(), category)] = (ids, time.monotonic() + self.ttl)
+        return ids
+
+    def buckets(self, category=0):
+        '''
+        {difficulty: array of question ids} of category, all difficulties
+        loaded together with one (id, difficulty) query
+        '''
+        key = (current_tenant(), category)
+        cached = self._buckets.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        query = db.session.query(Question.id, Question.difficulty)
+        if category:
+            query = query.filter(Question.category == category)
+        buckets = {difficulty: array('l') for difficulty in DIFFICULTIES}
+        with primary():
+            for id, difficulty in query.order_by(Question.id):
+                if difficulty in buckets:
+                    buckets[difficulty].append(id)
+        with self._lock:
+            self._buckets[key] = (buckets, time.monotonic() + self.ttl)
+        return buckets
+
+    def draw(self, category=0, seen=(), ids=None):
+        '''
+        random question id in category (or in ids, if given) that is not
+        in seen, or None
+        '''
+        drawn = self.draw_many(category, seen, 1, ids)
+        return drawn[0] if drawn else None
+
+    def draw_many(self, category=0, seen=(), count=1, ids=None):
+        '''
+        up to count distinct random question ids in category (or in ids,
+        if given) that are not in seen. Rejection sampling: while less
+        than half of the ids are taken each draw succeeds with probability
+        > 1/2, so this is O(count) expected.
+        '''
+        if ids is None:
+            ids = self.ids(category)
+        if not isinstance(seen, (set, SeenIds)):
+            seen = set(seen)
+        drawn = []
+        taken = set()
+        if len(seen) + count < len(ids):
+            for _ in range(MAX_DRAWS * count):
+                candidate = ids[random.randrange(len(ids))]
+                if candidate not in seen and candidate not in taken:
+                    drawn.append(candidate)
+                    taken.add(candidate)
+                    if len(drawn) == count:
+                        return drawn
+
+        # nearly every question was taken: sample among the few left
+        remaining = [id for id in ids if id not in seen and id not in taken]
+        return drawn + random.sample(remaining, min(count - len(drawn), len(remaining)))
+
+    def draw_near(self, category=0, difficulty=START_DIFFICULTY, seen=(), count=1):
+        '''
+        up to count random unseen question ids of the given difficulty in
+        category; once that bucket runs out, of the closest difficulties
+        with questions left (the easier one first on a tie)
+        '''
+        buckets = self.buckets(category)
+        if not isinstance(seen, (set, SeenIds)):
+            seen = set(seen)
+        drawn = []
+        for level in sorted(buckets, key=lambda level: (abs(level - difficulty), level)):
+            # buckets do not overlap, so ids drawn from others are not seen here
+            drawn += self.draw_many(category, seen, count - len(drawn), ids=buckets[level])
+            if len(drawn) == count:
+                break
+        return drawn
+
+    def question(self, category=0, seen=(), difficulty=None):
+        '''
+        random unseen Question in category, of the given difficulty or the
+        closest one left if given, fetched by primary key
+        '''
+        questions = self.questions(category, seen, 1, difficulty)
+        return questions[0] if questions else None
+
+    def questions(self, category=0, seen=(), count=1, difficulty=None):
+        '''
+        up to count random unseen Questions in category (of the given
+        difficulty or the closest ones left, if given), in random order,
+        fetched together with one primary key IN query
+        '''
+        for _ in range(2):
+            if difficulty is None:
+                ids = self.draw_many(category, seen, count)
+            else:
+                ids = self.draw_near(category, difficulty, seen, count)
+            if not ids:
+                return []
+            if len(ids) == 1:
+                question = db.session.get(Question, ids[0])
+                found = {question.id: question} if question is not None else {}
+            else:
+                found = {question.id: question for question in Question.query.filter(Question.id.in_(ids))}
+            if len(found) == len(ids):
+                break
+            # ids deleted by another process: reload the index and draw again
+            self.forget(category)
+        return [found[id] for id in ids if id in found]
+
+    def forget(self, category=0, tenant=None):
+        '''
+        drops the indexes of category, the next draw reloads them
+        '''
+        key = (tenant or current_tenant(), category)
+        with self._lock:
+            self._index.pop(key, None)
+            self._buckets.pop(key, None)
+
+    def on_question_write(self, action, record):
+        tenant = current_tenant()
+        with self._lock:
+            for index in (self._index, self._buckets):
+                if record is None or action == 'update':
+                    for key in [key for key in index if key[0] == tenant]:
+                        del index[key]
+                    continue
+                index.pop((tenant, 0), None)
+                if record['category'] is not None:
+                    index.pop((tenant, int(record['category'])), None)
+
+
+quiz_sampler = QuizSampler()
+question_listeners.append(quiz_sampler.on_question_write)
+
+
+"""
+SeenIds
+    the question ids already played in a quiz session, kept as a sorted
+    array of machine ints (8 bytes an id) with binary search lookups
+"""
+class SeenIds:
+
+    def __init__(self, ids=()):
+        self._ids = array('l', sorted(set(ids)))
+
+    def __contains__(self, id):
+        i = bisect.bisect_left(self._ids, id)
+        return i < len(self._ids) and self._ids[i] == id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, id):
+        i = bisect.bisect_left(self._ids, id)
+        if i == len(self._ids) or self._ids[i] != id:
+            self._ids.insert(i, id)
+
+    def tobytes(self):
+        return self._ids.tobytes()
+
+    @classmethod
+    def frombytes(cls, data):
+        seen = cls()
+        seen._ids.frombytes(data)
+        return seen
+
+
+"""
+QuizSession
+    server side state of one quiz: its tenant, category and the
+    questions played and the number answered correctly, its score.
+    unanswered counts the questions served but not answered yet, each
+    takes one answer, so the score never exceeds the questions played.
+    Adaptive sessions also keep the difficulty of their next questions
+    and the current streak of correct answers; difficulty is None for
+    sessions drawing from every difficulty.
+"""
+class QuizSession:
+
+    def __init__(self, id, category, seen=None, tenant=None, difficulty=None):
+        self.id = id
+        self.category = category
+        self.seen = seen if seen is not None else SeenIds()
+        self.tenant = tenant or current_tenant()
+        self.difficulty = difficulty
+        self.streak = 0
+        self.correct = 0
+        self.unanswered = 0
+
+
+"""
+MemorySessionStore
+    in-process quiz session store. Sessions expire ttl seconds after
+    their last use and the oldest are evicted past max_sessions.
+    Any object with the same get/put/delete methods can be used instead
+    (e.g. one backed by a shared cache, storing SeenIds.tobytes()),
+    through the QUIZ_SESSION_STORE config.
+"""
+class MemorySessionStore:
+
+    def __init__(self, ttl=3600, max_sessions=100000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            self._evict()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], time.monotonic() + self.ttl)
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def put(self, session):
+        with self._lock:
+            self._sessions[session.id] = (session, time.monotonic() + self.ttl)
+            self._sessions.move_to_end(session.id)
+            self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict(self):
+        # entries are ordered by last use, so expired ones are at the front
+        now = time.monotonic()
+        while self._sessions:
+            session_id, (session, expires) = next(iter(self._sessions.items()))
+            if expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+
+"""
+QuizSessions
+    quiz sessions on top of the QuizSampler: the client keeps only the
+    session id instead of resending previous_questions on every call
+"""
+class QuizSessions:
+
+    def __init__(self, sampler, store=None):
+        self.sampler = sampler
+        self.store = store if store is not None else MemorySessionStore()
+
+    def init_app(self, app):
+        store = app.config.get('QUIZ_SESSION_STORE')
+        if store is None:
+            store = MemorySessionStore(ttl=app.config['QUIZ_SESSION_TTL'])
+        self.store = store
+
+    def start(self, category=0, difficulty=None):
+        '''
+        new session of category, adaptive when it has a starting difficulty
+        '''
+        session = QuizSession(secrets.token_urlsafe(16), category, difficulty=difficulty)
+        self.store.put(session)
+        return session
+
+    def get(self, session_id):
+        '''
+        the session, None if it is unknown, expired or of another tenant
+        '''
+        session = self.store.get(session_id)
+        if session is None or session.tenant != current_tenant():
+            return None
+        return session
+
+    def next_question(self, session):
+        '''
+        next random unplayed Question of the session, None once all are played
+        '''
+        questions = self.next_questions(session, 1)
+        return questions[0] if questions else None
+
+    def next_questions(self, session, count):
+        '''
+        the next count random unplayed Questions of the session, fewer (or
+        none) once all are played. They count as played from now on.
+        '''
+        questions = self.sampler.questions(session.category, session.seen, count, session.difficulty)
+        if questions:
+            for question in questions:
+                session.seen.add(question.id)
+            session.unanswered += len(questions)
+            # written back for stores that keep a serialized copy
+            self.store.put(session)
+        return questions
+
+    def answer(self, session, correct):
+        '''
+        records whether the last question was answered correctly. In
+        adaptive sessions STREAK_UP correct answers in a row make the
+        next questions one level harder, a wrong one one level easier.
+        Returns False, recording nothing, when no served question is
+        waiting for an answer.
+        '''
+        if session.unanswered <= 0:
+            return False
+        session.unanswered -= 1
+        if correct:
+            session.correct += 1
+        if session.difficulty is not None:
+            if correct:
+                session.streak += 1
+                if session.streak >= STREAK_UP:
+                    session.difficulty = min(session.difficulty + 1, DIFFICULTIES[-1])
+                    session.streak = 0
+            else:
+                session.difficulty = max(session.difficulty - 1, DIFFICULTIES[0])
+                session.streak = 0
+        self.store.put(session)
+        return True
+
+    def end(self, session_id):
+        if self.get(session_id) is None:
+            return False
+        return self.store.delete(session_id)
+
+
+quiz_sessions = QuizSessions(quiz_sampler)
@@ -0,0 +1,66 @@
+import functools
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from models import db, Category, question_listeners
+
+# cookie holding the time until which the client reads from the primary
+STICKY_COOKIE = 'trivia_primary_until'
+
+def sticky():
+    '''
+    whether the client of the request wrote in the last
+    DB_REPLICA_STICKY_SECONDS and has to read from the primary
+    '''
+    try:
+        primary_until = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    return primary_until >= time.time()
+
+
+"""
+read_replica
+    view decorator for read-only endpoints: their queries go to a read
+    replica, unless the client wrote in the last DB_REPLICA_STICKY_SECONDS
+    and must read its own writes from the primary. A view that fails on
+    its replica is retried once on the primary.
+"""
+def read_replica(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = not sticky()
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            if not g.get('replica_engine'):
+                raise
+            # the replica is marked down by the router, the view only
+            # reads so it is safe to run it again on the primary
+            db.session.rollback()
+            g.read_replica = False
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+def on_write(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def init_app(app):
+    window = int(app.config['DB_REPLICA_STICKY_SECONDS'])
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and window > 0:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + window), max_age=window, httponly=True)
+        return response
+
+
+question_listeners.append(on_write)
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, on_write)
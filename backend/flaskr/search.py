@@ -0,0 +1,431 @@
+import heapq
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_request_context
+from sqlalchemy import func, text
+
+from models import db, Question, question_listeners, question_columns, format_row, current_tenant, primary
+
+
+# words of question text offered by autocomplete
+TOKEN_PATTERN = re.compile(r'\w{2,}')
+# suggestions kept per trie node, the most an autocomplete call returns
+MAX_SUGGESTIONS = 20
+
+
+def normalize(term):
+    '''
+    search term as searched and cached: lowercased, runs of whitespace
+    collapsed to one space
+    '''
+    return ' '.join(term.split()).lower()
+
+
+def tokens(text):
+    return set(TOKEN_PATTERN.findall((text or '').lower()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def rank(text, term):
+    '''
+    sort key of a match: whole-word matches first, then earlier
+    matches, then shorter questions (closest to the term)
+    '''
+    position = text.find(term)
+    word_start = position == 0 or not text[position - 1].isalnum()
+    return (not word_start, position, len(text))
+
+
+"""
+TrigramIndex
+    in-process inverted index from the character trigrams of each
+    lowercased question to question ids. Every trigram of a substring is
+    a trigram of the text, so intersecting the postings of the term's
+    trigrams gives the few candidates that are then checked exactly.
+    Writes and searches hold the lock of the index, so a search never
+    sees it half updated.
+"""
+class TrigramIndex:
+
+    def __init__(self):
+        self.texts = {}
+        self.postings = {}
+        self._lock = threading.Lock()
+
+    def add(self, id, question):
+        text = (question or '').lower()
+        with self._lock:
+            self._remove(id)
+            self.texts[id] = text
+            for gram in trigrams(text):
+                self.postings.setdefault(gram, set()).add(id)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        text = self.texts.pop(id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, term):
+        '''
+        ids of the questions containing term, best match first
+        '''
+        term = term.lower()
+        grams = trigrams(term)
+        with self._lock:
+            if grams:
+                postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                # terms under 3 characters have no trigram to look up
+                candidates = self.texts.keys()
+            matches = [(rank(self.texts[id], term) + (id,), id) for id in candidates if term in self.texts[id]]
+        matches.sort()
+        return [id for _, id in matches]
+
+
+"""
+PrefixTrie
+    the words of question text in a character trie, each word counted
+    once per question containing it. A node caches its MAX_SUGGESTIONS
+    most frequent completions; adding or removing a word clears the
+    caches on its path only, so the trie is updated in place on writes.
+    Writes and completions hold the lock of the trie.
+"""
+class TrieNode:
+    __slots__ = ('children', 'count', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        self.top = None
+
+
+class PrefixTrie:
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.words = {}
+        self._lock = threading.Lock()
+
+    def add(self, id, question):
+        words = tokens(question)
+        with self._lock:
+            self._remove(id)
+            self.words[id] = words
+            for word in words:
+                node = self.root
+                node.top = None
+                for char in word:
+                    node = node.children.setdefault(char, TrieNode())
+                    node.top = None
+                node.count += 1
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        for word in self.words.pop(id, ()):
+            path = [self.root]
+            for char in word:
+                path.append(path[-1].children[char])
+            path[-1].count -= 1
+            for node in path:
+                node.top = None
+            # prune the nodes left without words
+            for char, parent, node in zip(reversed(word), reversed(path[:-1]), reversed(path[1:])):
+                if node.count or node.children:
+                    break
+                del parent.children[char]
+
+    def complete(self, prefix, limit=10):
+        '''
+        the most frequent words starting with prefix, most frequent first
+        '''
+        with self._lock:
+            node = self.root
+            for char in prefix.lower():
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            if node.top is None:
+                node.top = [word for count, word in heapq.nsmallest(
+                    MAX_SUGGESTIONS, ((-count, word) for word, count in self.walk(node, prefix.lower()))
+                )]
+            return node.top[:limit]
+
+    def walk(self, node, prefix):
+        '''
+        (word, count) of every word below node, with the lock held
+        '''
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            if node.count:
+                yield word, node.count
+            for char, child in node.children.items():
+                stack.append((child, word + char))
+
+
+"""
+SearchResultCache
+    LRU of search results per tenant and normalized term (and page).
+    Keys carry the version of their tenant, bumped by every question
+    write, so a write invalidates all cached searches of the tenant at
+    once; entries also expire after ttl seconds for writes made by other
+    workers. Results read from a replica within replica_lag seconds of
+    a bump are not stored, the replica may not have the write yet.
+"""
+class SearchResultCache:
+
+    def __init__(self, max_entries=1024, ttl=60, replica_lag=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bumped = {}
+        self._lock = threading.Lock()
+
+    def key(self, tenant, *args):
+        return (tenant, self._versions.get(tenant, 0)) + args
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        if not self.max_entries or self.stale_replica_read(key[0]):
+            return
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self, tenant):
+        # entries of older versions are never read again and age out
+        with self._lock:
+            self._versions[tenant] = self._versions.get(tenant, 0) + 1
+            self._bumped[tenant] = time.monotonic()
+
+    def stale_replica_read(self, tenant):
+        if not has_request_context() or not g.get('replica_engine'):
+            return False
+        return self._bumped.get(tenant, float('-inf')) + self.replica_lag > time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+"""
+QuestionSearch
+    case-insensitive substring search over Question.question, ranked.
+    On Postgres a pg_trgm GIN index serves the ILIKE '%term%' query and
+    results are ordered by trigram similarity(). Other backends use an
+    in-process TrigramIndex per tenant, kept up to date by question
+    writes and rebuilt after ttl seconds to pick up writes from other
+    workers. Results are cached by normalized term in a SearchResultCache,
+    and words of question text are suggested from a PrefixTrie per
+    tenant kept up to date the same way as the TrigramIndex.
+"""
+class QuestionSearch:
+
+    def __init__(self, backend='auto', ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._indexes = {}
+        self._tries = {}
+        self._builds = {}
+        self._similarity = None
+        self._lock = threading.Lock()
+        self.results = SearchResultCache()
+
+    def init_app(self, app):
+        self.ttl = app.config['SEARCH_INDEX_TTL']
+        self.backend = app.config['SEARCH_BACKEND']
+        self._similarity = None
+        self.results = SearchResultCache(app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'],
+                                         app.config['DB_REPLICA_STICKY_SECONDS'])
+        self.clear()
+
+    def resolve_backend(self):
+        '''
+        settles 'auto' and checks for pg_trgm on the first search rather
+        than at startup, which needs no database round trip
+        '''
+        if self.backend == 'auto':
+            postgres = db.engine.dialect.name == 'postgresql'
+            self.backend = 'database' if postgres else 'memory'
+        if self._similarity is None:
+            self._similarity = (self.backend == 'database' and db.engine.dialect.name == 'postgresql'
+                                and self.has_trigram_extension())
+        return self.backend
+
+    def has_trigram_extension(self):
+        # the index itself is created by migration 4
+        return db.session.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).scalar() is not None
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._tries.clear()
+        self.results.clear()
+
+    def search(self, term, page=1, after_id=None, per_page=10):
+        '''
+        Returns the formatted questions of the page, the total number of
+        matches and the next_cursor. Pages are ranked; with after_id the
+        questions are in id order after that id, like paginate_questions,
+        and only then is there a next_cursor (None for ranked pages).
+        '''
+        term = normalize(term)
+        key = self.results.key(current_tenant(), term, page, after_id, per_page)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+
+        if self.resolve_backend() == 'memory':
+            result = self._search_index(term, page, after_id, per_page)
+        else:
+            result = self._search_database(term, page, after_id, per_page)
+        self.results.put(key, result)
+        return result
+
+    def suggest(self, prefix, limit=10):
+        '''
+        words of question text starting with prefix, the ones in the
+        most questions first
+        '''
+        return self.trie().complete(prefix.strip(), limit)
+
+    def _search_database(self, term, page, after_id, per_page):
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        selection = Question.query.filter(
+            Question.question.ilike(f'%{escaped}%', escape='\\')
+        )
+        total = selection.count()
+
+        selection = selection.with_entities(*question_columns())
+        if after_id is not None:
+            rows = selection.filter(Question.id > after_id).order_by(Question.id).limit(per_page + 1).all()
+            next_cursor = rows[per_page - 1].id if len(rows) > per_page else None
+            return [format_row(row) for row in rows[:per_page]], total, next_cursor
+
+        if self._similarity:
+            selection = selection.order_by(func.similarity(Question.question, term).desc())
+        rows = selection.order_by(Question.id).offset((page - 1) * per_page).limit(per_page).all()
+        return [format_row(row) for row in rows], total, None
+
+    def _search_index(self, term, page, after_id, per_page):
+        matches = self.index().search(term)
+        total = len(matches)
+
+        next_cursor = None
+        if after_id is not None:
+            following = sorted(id for id in matches if id > after_id)
+            page_ids = following[:per_page]
+            if len(following) > per_page:
+                next_cursor = page_ids[-1]
+        else:
+            page_ids = matches[(page - 1) * per_page:page * per_page]
+
+        rows = Question.query.with_entities(*question_columns()).filter(Question.id.in_(page_ids))
+        rows = {row.id: row for row in rows}
+        return [format_row(rows[id]) for id in page_ids if id in rows], total, next_cursor
+
+    def index(self):
+        '''
+        TrigramIndex of the questions of the current tenant
+        '''
+        return self._load(self._indexes, TrigramIndex)
+
+    def _load(self, indexes, factory):
+        '''
+        the index of the current tenant in indexes, built by adding every
+        question to factory() when missing or expired. The build runs
+        outside the lock; question writes made meanwhile are logged and
+        replayed on the new index before it is swapped in.
+        '''
+        tenant = current_tenant()
+        cached = indexes.get(tenant)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        log = []
+        with self._lock:
+            self._builds.setdefault(tenant, []).append(log)
+        index = factory()
+        built = False
+        try:
+            with primary():
+                for id, question in db.session.query(Question.id, Question.question).yield_per(1000):
+                    index.add(id, question)
+            built = True
+        finally:
+            with self._lock:
+                self._builds[tenant] = [other for other in self._builds[tenant] if other is not log]
+                # a bulk write (record None) cannot be replayed, the
+                # index is used for this request but not kept
+                if built and all(record is not None for _, record in log):
+                    for action, record in log:
+                        self._apply(index, action, record)
+                    indexes[tenant] = (index, time.monotonic() + self.ttl)
+        return index
+
+    def trie(self):
+        '''
+        PrefixTrie of the words of the questions of the current tenant
+        '''
+        return self._load(self._tries, PrefixTrie)
+
+    def on_question_write(self, action, record):
+        tenant = current_tenant()
+        self.results.bump(tenant)
+        with self._lock:
+            for log in self._builds.get(tenant, ()):
+                log.append((action, record))
+            for indexes in (self._indexes, self._tries):
+                cached = indexes.get(tenant)
+                if cached is None:
+                    continue
+                if record is None:
+                    del indexes[tenant]
+                else:
+                    self._apply(cached[0], action, record)
+
+    def _apply(self, index, action, record):
+        if action == 'delete':
+            index.remove(record['id'])
+        else:
+            index.add(record['id'], record['question'])
+
+
+question_search = QuestionSearch()
+question_listeners.append(question_search.on_question_write)
@@ -0,0 +1,43 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+OrjsonProvider
+    app.json provider on orjson: several times faster than the stdlib
+    encoder for the large question listings. Output matches the default
+    provider (sorted keys, int dict keys as strings, dates in HTTP
+    format), only without the spaces after separators.
+"""
+class OrjsonProvider(DefaultJSONProvider):
+
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode()
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=self.default, option=self.options)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def json_provider(app):
+    '''
+    the app.json provider named by JSON_SERIALIZER: 'orjson', 'stdlib',
+    or 'auto' (orjson when it is installed)
+    '''
+    serializer = app.config['JSON_SERIALIZER']
+    if serializer == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_SERIALIZER is orjson but orjson is not installed')
+    if serializer == 'stdlib' or orjson is None:
+        return DefaultJSONProvider(app)
+    return OrjsonProvider(app)
@@ -0,0 +1,47 @@
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+"""
+StartupProfile
+    wall time of each step of create_app, measured between mark() calls.
+    Logged at debug level and printed by `flask startup-profile`.
+"""
+class StartupProfile:
+
+    def __init__(self, imports=None):
+        self.steps = []
+        if imports is not None:
+            self.steps.append(('imports (once per process)', imports))
+        self._last = time.perf_counter()
+
+    def mark(self, name):
+        '''
+        records the time since the previous mark as step name
+        '''
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return sum(seconds for name, seconds in self.steps)
+
+    def report(self):
+        lines = ['{:<32} {:>9.2f} ms'.format(name, seconds * 1000) for name, seconds in self.steps]
+        lines.append('{:<32} {:>9.2f} ms'.format('total', self.total() * 1000))
+        return '\n'.join(lines)
+
+
+@click.command('startup-profile')
+@with_appcontext
+def startup_profile_command():
+    '''Show how long each step of the app startup took.'''
+    click.echo(current_app.extensions['startup_profile'].report())
+
+
+def init_app(app, profile):
+    app.extensions['startup_profile'] = profile
+    app.cli.add_command(startup_profile_command)
@@ -0,0 +1,30 @@
+import re
+from flask import abort, g, request
+
+from models import DEFAULT_TENANT
+
+TENANT_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+"""
+tenant resolution
+    every request works on the question bank of one tenant, named by the
+    TENANT_HEADER request header (DEFAULT_TENANT without one). Models
+    filter on it through models.current_tenant() and the caches, counts
+    and quiz indexes are kept per tenant.
+"""
+def init_app(app):
+    header = app.config['TENANT_HEADER']
+
+    @app.before_request
+    def resolve_tenant():
+        tenant = request.headers.get(header) or DEFAULT_TENANT
+        if not TENANT_PATTERN.match(tenant):
+            abort(400)
+        g.tenant = tenant
+
+    @app.after_request
+    def vary_by_tenant(response):
+        # the same URL answers differently per tenant, for shared caches
+        response.vary.add(header)
+        return response
@@ -0,0 +1,362 @@
+import logging
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, shard_router, Score
+
+logger = logging.getLogger(__name__)
+
+# rows updated per transaction when a migration backfills a column
+BATCH_SIZE = 10000
+# key of the postgres advisory lock held while migrating, so that
+# workers starting together do not run the same migration twice
+LOCK_KEY = 7270012
+
+"""
+schema_migrations
+    one row per applied migration, the schema version is the highest
+"""
+metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime)
+)
+
+"""
+MIGRATIONS
+    (version, description, function(engine)) in version order. Every
+    migration checks the live schema first, so it can be re-run safely,
+    and none holds a long exclusive lock on a populated table.
+"""
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        return function
+    return register
+
+
+def is_postgres(engine):
+    return engine.dialect.name == 'postgresql'
+
+
+def autocommit(engine):
+    '''
+    connection for statements that cannot run in a transaction,
+    like CREATE INDEX CONCURRENTLY
+    '''
+    return engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+
+@migration(1, 'categories and questions tables')
+def create_tables(engine):
+    # a new database gets the current schema from the models, the later
+    # migrations then find nothing to do; an existing one is the baseline
+    if not inspect(engine).has_table('questions'):
+        db.metadata.create_all(engine)
+
+
+@migration(2, 'questions.category as an integer foreign key to categories.id')
+def category_integer_foreign_key(engine):
+    columns = {column['name']: column for column in inspect(engine).get_columns('questions')}
+    is_integer = isinstance(columns['category']['type'], Integer)
+
+    if is_postgres(engine):
+        if not is_integer:
+            _postgres_category_to_integer(engine)
+        _postgres_category_foreign_key(engine)
+    else:
+        foreign_keys = inspect(engine).get_foreign_keys('questions')
+        if not is_integer or not foreign_keys:
+            _rebuild_questions_table(engine)
+
+
+def _postgres_category_to_integer(engine):
+    '''
+    Adds an integer column kept in sync by a trigger, backfills it in
+    batches of BATCH_SIZE rows, then swaps it in: only the final swap
+    takes an exclusive lock, and it does not rewrite the table.
+    '''
+    convert = "CASE WHEN {0} ~ '^\\s*[0-9]+\\s*$' THEN trim({0})::integer END"
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_int integer'))
+        connection.execute(text(
+            'CREATE OR REPLACE FUNCTION questions_category_int() RETURNS trigger AS $$ '
+            'BEGIN NEW.category_int := ' + convert.format('NEW.category') + '; RETURN NEW; END '
+            '$$ LANGUAGE plpgsql'
+        ))
+        connection.execute(text('DROP TRIGGER IF EXISTS questions_category_int ON questions'))
+        connection.execute(text(
+            'CREATE TRIGGER questions_category_int BEFORE INSERT OR UPDATE OF category '
+            'ON questions FOR EACH ROW EXECUTE PROCEDURE questions_category_int()'
+        ))
+
+    with engine.connect() as connection:
+        last_id = connection.execute(text('SELECT coalesce(max(id), 0) FROM questions')).scalar()
+    for start in range(0, last_id, BATCH_SIZE):
+        with engine.begin() as connection:
+            connection.execute(
+                text('UPDATE questions SET category_int = ' + convert.format('category') +
+                     ' WHERE id > :start AND id <= :end'),
+                {'start': start, 'end': start + BATCH_SIZE}
+            )
+
+    with engine.begin() as connection:
+        connection.execute(text('DROP TRIGGER questions_category_int ON questions'))
+        connection.execute(text('DROP FUNCTION questions_category_int()'))
+        connection.execute(text('ALTER TABLE questions DROP COLUMN category'))
+        connection.execute(text('ALTER TABLE questions RENAME COLUMN category_int TO category'))
+
+
+def _postgres_category_foreign_key(engine):
+    if any(key['referred_table'] == 'categories' for key in inspect(engine).get_foreign_keys('questions')):
+        return
+    with engine.begin() as connection:
+        # questions of a category that no longer exists keep no category
+        orphans = connection.execute(text(
+            'UPDATE questions SET category = NULL WHERE category IS NOT NULL '
+            'AND NOT EXISTS (SELECT 1 FROM categories WHERE categories.id = questions.category)'
+        )).rowcount
+        if orphans:
+            logger.warning('%d questions referenced missing categories', orphans)
+        # NOT VALID skips the full scan under lock, VALIDATE then checks
+        # the rows while reads and writes go on
+        connection.execute(text(
+            'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey '
+            'FOREIGN KEY (category) REFERENCES categories (id) NOT VALID'
+        ))
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE questions VALIDATE CONSTRAINT questions_category_fkey'))
+
+
+def _rebuild_questions_table(engine):
+    # sqlite cannot alter a column type or add a constraint in place
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE questions_new ('
+            'id INTEGER NOT NULL PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+            'category INTEGER REFERENCES categories (id), difficulty INTEGER)'
+        ))
+        connection.execute(text(
+            'INSERT INTO questions_new (id, question, answer, category, difficulty) '
+            'SELECT id, question, answer, '
+            'CASE WHEN category IN (SELECT id FROM categories) THEN CAST(category AS INTEGER) END, '
+            'difficulty FROM questions'
+        ))
+        connection.execute(text('DROP TABLE questions'))
+        connection.execute(text('ALTER TABLE questions_new RENAME TO questions'))
+
+
+@migration(3, 'indexes on questions (category, id) and (difficulty)')
+def question_indexes(engine):
+    indexes = (
+        ('ix_questions_category_id', 'questions (category, id)'),
+        ('ix_questions_difficulty', 'questions (difficulty)'),
+    )
+    if is_postgres(engine):
+        # CONCURRENTLY builds without blocking writes to the table
+        with autocommit(engine) as connection:
+            for name, columns in indexes:
+                connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {columns}'))
+    else:
+        with engine.begin() as connection:
+            for name, columns in indexes:
+                connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {columns}'))
+
+
+@migration(4, 'pg_trgm index on questions.question for search')
+def question_trigram_index(engine):
+    if not is_postgres(engine):
+        return
+    with autocommit(engine) as connection:
+        try:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except SQLAlchemyError:
+            # needs a privileged role; search falls back to a plain ILIKE scan
+            logger.warning('pg_trgm is not available, question search is not indexed')
+            return
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_trgm '
+            'ON questions USING gin (question gin_trgm_ops)'
+        ))
+
+
+@migration(5, 'tenant column on questions and categories')
+def tenant_columns(engine):
+    # a constant default makes ADD COLUMN a catalog-only change on
+    # postgres 11+, existing rows belong to the default tenant
+    for table in ('questions', 'categories'):
+        columns = {column['name'] for column in inspect(engine).get_columns(table)}
+        if 'tenant' not in columns:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN tenant VARCHAR NOT NULL DEFAULT 'default'"
+                ))
+
+    statements = (
+        'CREATE INDEX {} IF NOT EXISTS ix_questions_tenant_category_id ON questions (tenant, category, id)',
+        'CREATE INDEX {} IF NOT EXISTS ix_questions_tenant_id ON questions (tenant, id)',
+        'CREATE INDEX {} IF NOT EXISTS ix_categories_tenant ON categories (tenant)',
+        # every question query is scoped to a tenant now
+        'DROP INDEX {} IF EXISTS ix_questions_category_id',
+    )
+    if is_postgres(engine):
+        with autocommit(engine) as connection:
+            for statement in statements:
+                connection.execute(text(statement.format('CONCURRENTLY')))
+    else:
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement.format('')))
+
+
+@migration(6, 'scores table for the leaderboard')
+def scores_table(engine):
+    # a new, empty table: created with its indexes in one go
+    Score.__table__.create(engine, checkfirst=True)
+
+
+@migration(7, 'questions (tenant, category) foreign key to categories (tenant, id)')
+def tenant_category_foreign_key(engine):
+    if any(key['constrained_columns'] == ['tenant', 'category']
+           for key in inspect(engine).get_foreign_keys('questions')):
+        return
+    if is_postgres(engine):
+        _postgres_tenant_category_foreign_key(engine)
+    else:
+        _rebuild_questions_table_tenant_category(engine)
+
+
+# questions whose category belongs to another tenant
+CROSS_TENANT_CATEGORY = (
+    'category IS NOT NULL AND NOT EXISTS (SELECT 1 FROM categories '
+    'WHERE categories.id = questions.category AND categories.tenant = questions.tenant)'
+)
+
+
+def _postgres_tenant_category_foreign_key(engine):
+    with autocommit(engine) as connection:
+        connection.execute(text(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_categories_tenant_id ON categories (tenant, id)'
+        ))
+    unique = {constraint['name'] for constraint in inspect(engine).get_unique_constraints('categories')}
+    old_keys = [key['name'] for key in inspect(engine).get_foreign_keys('questions')
+                if key['constrained_columns'] == ['category']]
+    with engine.begin() as connection:
+        if 'uq_categories_tenant_id' not in unique:
+            connection.execute(text(
+                'ALTER TABLE categories ADD CONSTRAINT uq_categories_tenant_id UNIQUE USING INDEX uq_categories_tenant_id'
+            ))
+        orphans = connection.execute(text(f'UPDATE questions SET category = NULL WHERE {CROSS_TENANT_CATEGORY}')).rowcount
+        if orphans:
+            logger.warning('%d questions referenced categories of other tenants', orphans)
+        for name in old_keys:
+            connection.execute(text(f'ALTER TABLE questions DROP CONSTRAINT {name}'))
+        # NOT VALID then VALIDATE, as in migration 2
+        connection.execute(text(
+            'ALTER TABLE questions ADD CONSTRAINT questions_tenant_category_fkey '
+            'FOREIGN KEY (tenant, category) REFERENCES categories (tenant, id) NOT VALID'
+        ))
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE questions VALIDATE CONSTRAINT questions_tenant_category_fkey'))
+
+
+def _rebuild_questions_table_tenant_category(engine):
+    # sqlite cannot add a constraint in place; the indexes go with the table
+    with engine.begin() as connection:
+        connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_categories_tenant_id ON categories (tenant, id)'))
+        connection.execute(text(
+            'CREATE TABLE questions_new ('
+            'id INTEGER NOT NULL PRIMARY KEY, question VARCHAR, answer VARCHAR, category INTEGER, '
+            "difficulty INTEGER, tenant VARCHAR NOT NULL DEFAULT 'default', "
+            'CONSTRAINT questions_tenant_category_fkey FOREIGN KEY (tenant, category) '
+            'REFERENCES categories (tenant, id))'
+        ))
+        connection.execute(text(
+            'INSERT INTO questions_new (id, question, answer, category, difficulty, tenant) '
+            f'SELECT id, question, answer, CASE WHEN {CROSS_TENANT_CATEGORY} THEN NULL ELSE category END, '
+            'difficulty, tenant FROM questions'
+        ))
+        connection.execute(text('DROP TABLE questions'))
+        connection.execute(text('ALTER TABLE questions_new RENAME TO questions'))
+        for statement in (
+            'CREATE INDEX ix_questions_tenant_category_id ON questions (tenant, category, id)',
+            'CREATE INDEX ix_questions_tenant_id ON questions (tenant, id)',
+            'CREATE INDEX ix_questions_difficulty ON questions (difficulty)',
+        ):
+            connection.execute(text(statement))
+
+
+def current_version(engine):
+    if not inspect(engine).has_table('schema_migrations'):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(text('SELECT coalesce(max(version), 0) FROM schema_migrations')).scalar()
+
+
+def upgrade(engine, target=None):
+    '''
+    Applies the migrations above the current schema version, up to
+    target (default: all). Returns the versions applied.
+    '''
+    lock = None
+    if is_postgres(engine):
+        lock = autocommit(engine)
+        lock.execute(text('SELECT pg_advisory_lock(:key)'), {'key': LOCK_KEY})
+
+    try:
+        metadata.create_all(engine)
+        version = current_version(engine)
+        applied = []
+        for number, description, function in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            logger.info('migrating to version %d: %s', number, description)
+            function(engine)
+            with engine.begin() as connection:
+                connection.execute(schema_migrations.insert().values(
+                    version=number,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc)
+                ))
+            applied.append(number)
+        return applied
+    finally:
+        if lock is not None:
+            lock.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': LOCK_KEY})
+            lock.close()
+
+
+@click.command('db-upgrade')
+@click.option('--target', type=int, default=None, help='stop at this version')
+@with_appcontext
+def upgrade_command(target):
+    '''Apply pending schema migrations (on the primary and every shard).'''
+    for engine in shard_router.engines(db.engines):
+        applied = upgrade(engine, target)
+        click.echo('{}: applied {}, schema version {}'.format(
+            engine.url.render_as_string(hide_password=True), applied or 'nothing', current_version(engine)))
+
+
+@click.command('db-version')
+@with_appcontext
+def version_command():
+    '''Show the schema version and the pending migrations.'''
+    for engine in shard_router.engines(db.engines):
+        version = current_version(engine)
+        click.echo('{}: schema version {}'.format(engine.url.render_as_string(hide_password=True), version))
+        for number, description, function in MIGRATIONS:
+            if number > version:
+                click.echo(f'pending {number}: {description}')
+
+
+def init_app(app):
+    app.cli.add_command(upgrade_command)
+    app.cli.add_command(version_command)
@@ -1,48 +1,430 @@
 import os
 import sys
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_app_context, has_request_context
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKeyConstraint, Index, UniqueConstraint, create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import with_loader_criteria
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 import json
 from dotenv import load_dotenv
 
-# load .env file in backend dir using python-dotenv lib
+# .env file in backend dir, read by load_env() with python-dotenv lib
 path = os.path.dirname(os.path.dirname(__file__))
 env_file = os.path.join(path, ".env")
-load_dotenv(env_file)
 
-# read variables from .env file with os.getenv()
-database_name = os.getenv('DB_NAME')
-db_host = os.getenv('DB_HOST')
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASS')
+def load_env():
+    '''
+    loads the .env file into os.environ; called by the app factories
+    rather than on import, so importing models has no side effects
+    '''
+    load_dotenv(env_file)
 
-# connect to trivia db
-database_path = 'postgresql://{}:{}@{}/{}'.format(db_user, db_password, db_host, database_name)
+def default_database_path():
+    '''
+    trivia db URI from the DB_* variables of the environment (or .env)
+    '''
+    return 'postgresql://{}:{}@{}/{}'.format(
+        os.getenv('DB_USER'), os.getenv('DB_PASS'), os.getenv('DB_HOST'), os.getenv('DB_NAME')
+    )
 
-db = SQLAlchemy()
+"""
+ReplicaRouter
+    read replicas registered by setup_db as binds 'replica_0', ...
+    choose() hands them out round-robin, skipping any that failed in
+    the last retry_after seconds; a failed replica is probed with
+    SELECT 1 before it gets traffic again.
+"""
+class ReplicaRouter:
+
+    def __init__(self, retry_after=30):
+        self.retry_after = retry_after
+        self.keys = []
+        self._down = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, replicas):
+        self.keys = ['replica_{}'.format(i) for i in range(len(replicas))]
+        self.retry_after = int(app.config.get('DB_REPLICA_RETRY', os.getenv('DB_REPLICA_RETRY', 30)))
+        self._down.clear()
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for key, uri in zip(self.keys, replicas):
+            # same pool profile and statement timeout as the primary
+            binds[key] = dict(engine_options(app, uri), url=uri)
+            binds[key].setdefault('pool_pre_ping', True)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+    def watch(self, engines):
+        for key in self.keys:
+            event.listen(engines[key], 'handle_error', lambda context, key=key: self.mark_down(key))
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down[key] = time.monotonic() + self.retry_after
+
+    def healthy(self, key, engine):
+        down_until = self._down.get(key)
+        if down_until is None:
+            return True
+        if down_until > time.monotonic():
+            return False
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except Exception:
+            self.mark_down(key)
+            return False
+        with self._lock:
+            self._down.pop(key, None)
+        return True
+
+    def choose(self, engines):
+        '''
+        next healthy replica engine, None when there is none
+        '''
+        for _ in range(len(self.keys)):
+            with self._lock:
+                key = self.keys[self._next % len(self.keys)]
+                self._next += 1
+            if self.healthy(key, engines[key]):
+                return engines[key]
+        return None
+
+replica_router = ReplicaRouter()
+
+# tenant of requests that do not name one, and of existing rows
+DEFAULT_TENANT = 'default'
+# tenant of the running task outside of a flask app context (the ASGI app)
+tenant_context = ContextVar('tenant', default=DEFAULT_TENANT)
+
+def current_tenant():
+    '''
+    tenant of the current request (g.tenant, set by flaskr/tenants.py),
+    DEFAULT_TENANT outside of one
+    '''
+    if has_app_context():
+        return g.get('tenant', DEFAULT_TENANT)
+    return tenant_context.get()
+
+"""
+ShardRouter
+    tenant to database routing: shards registered by setup_db as binds
+    'shard_<name>', tenants mapped to a shard by name. Tenants without a
+    shard live in the primary database.
+"""
+class ShardRouter:
+
+    def __init__(self):
+        self.shards = {}
+        self.tenants = {}
+
+    def init_app(self, app, shards, tenants):
+        self.shards = {name: 'shard_{}'.format(name) for name in shards}
+        for tenant, shard in tenants.items():
+            if shard not in self.shards:
+                raise ValueError('tenant {!r} is mapped to unknown shard {!r}'.format(tenant, shard))
+        self.tenants = {tenant: self.shards[shard] for tenant, shard in tenants.items()}
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for name, uri in shards.items():
+            binds[self.shards[name]] = dict(engine_options(app, uri), url=uri)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+    def key(self, tenant):
+        '''
+        bind key of the shard of tenant, None for the primary database
+        '''
+        return self.tenants.get(tenant)
+
+    def engines(self, engines):
+        '''
+        the primary and every shard engine, e.g. to migrate them all
+        '''
+        return [engines[None]] + [engines[key] for key in self.shards.values()]
+
+shard_router = ShardRouter()
+
+class RoutingSession(Session):
+    '''
+    sends the statements of a tenant with a shard to that shard, those of
+    requests marked g.read_replica (see flaskr/replicas.py) to a read
+    replica, everything else to the primary
+    '''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_router.tenants:
+            key = shard_router.key(current_tenant())
+            if key is not None:
+                return self._db.engines[key]
+        if (bind is None and replica_router.keys and not self._flushing
+                and has_request_context() and g.get('read_replica')):
+            # one replica for the whole request, for consistent reads
+            if 'replica_engine' not in g:
+                g.replica_engine = replica_router.choose(self._db.engines)
+            if g.replica_engine is not None:
+                return g.replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+@contextmanager
+def primary():
+    '''
+    runs the statements of the block on the primary (or the shard of the
+    tenant) in a read_replica view: for caches kept past the request,
+    which would otherwise keep the lag of the replica they were loaded from
+    '''
+    if not has_request_context() or not g.get('read_replica'):
+        yield
+        return
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = True
+
+
+class TenantScoped:
+    '''
+    models whose rows belong to a tenant: ORM queries only see the rows of
+    current_tenant() and new rows get it as their tenant
+    '''
+    tenant = Column(String, nullable=False, default=current_tenant, server_default=DEFAULT_TENANT)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def scope_to_tenant(orm_execute_state):
+    if orm_execute_state.execution_options.get('all_tenants'):
+        return
+    if orm_execute_state.is_select or orm_execute_state.is_update or orm_execute_state.is_delete:
+        tenant = current_tenant()
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            with_loader_criteria(TenantScoped, lambda cls: cls.tenant == tenant, include_aliases=True)
+        )
+
+"""
+PoolMetrics
+    connection pool checkout wait times, filled in by TimedQueuePool
+"""
+class PoolMetrics:
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+    def snapshot(self, pool=None):
+        '''
+        counters plus the current saturation of pool: connections checked
+        out over the most the pool can hand out (size + max overflow)
+        '''
+        stats = {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds_total': self.wait_seconds_total,
+            'wait_seconds_max': self.wait_seconds_max
+        }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            stats['checked_out'] = pool.checkedout()
+            stats['capacity'] = capacity
+            stats['saturation'] = pool.checkedout() / capacity if capacity else 0.0
+        return stats
+
+pool_metrics = PoolMetrics()
+
+class TimedCheckout:
+    '''pool mixin that records how long each checkout waited'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return connection
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    '''QueuePool that records how long each checkout waited'''
+
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    '''TimedQueuePool of async engines'''
+
+"""
+POOL_PROFILES
+    engine options per DB_POOL_PROFILE, single DB_POOL_* settings
+    override them. 'pgbouncer' leaves pooling to PgBouncer: no pool in
+    the worker and no server-side prepared statements, which do not
+    survive transaction pooling.
+"""
+POOL_PROFILES = {
+    'default': {},
+    'worker': {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    },
+    'pgbouncer': {
+        'poolclass': NullPool
+    }
+}
+
+def engine_options(app, database_path):
+    '''
+    SQLALCHEMY_ENGINE_OPTIONS for the pooling profile in app.config or env
+    '''
+    def setting(key, cast=str):
+        value = app.config.get(key, os.getenv(key))
+        if value is None or value == '':
+            return None
+        if cast is bool:
+            return str(value).lower() in ('1', 'true', 'yes')
+        return cast(value)
+
+    profile = setting('DB_POOL_PROFILE') or 'default'
+    if profile not in POOL_PROFILES:
+        raise ValueError('unknown DB_POOL_PROFILE {!r}'.format(profile))
+    options = dict(POOL_PROFILES[profile])
+
+    for key, option, cast in (
+        ('DB_POOL_SIZE', 'pool_size', int),
+        ('DB_MAX_OVERFLOW', 'max_overflow', int),
+        ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+        ('DB_POOL_RECYCLE', 'pool_recycle', int),
+        ('DB_POOL_PRE_PING', 'pool_pre_ping', bool),
+    ):
+        value = setting(key, cast)
+        if value is not None:
+            options[option] = value
+
+    url = make_url(database_path)
+    connect_args = {}
+    if profile == 'pgbouncer':
+        # pool sizing belongs to PgBouncer
+        for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(option, None)
+        if url.drivername.endswith('+psycopg'):
+            connect_args['prepare_threshold'] = None
+        elif url.drivername.endswith('+asyncpg'):
+            connect_args['statement_cache_size'] = 0
+            connect_args['prepared_statement_cache_size'] = 0
+            # statements still prepared get names unique across connections
+            connect_args['prepared_statement_name_func'] = lambda: '__asyncpg_{}__'.format(uuid.uuid4())
+    elif url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+        async_driver = url.get_dialect().is_async
+        options.setdefault('poolclass', TimedAsyncQueuePool if async_driver else TimedQueuePool)
+
+    statement_timeout = setting('DB_STATEMENT_TIMEOUT', int)
+    if statement_timeout and url.get_backend_name() == 'postgresql' and profile != 'pgbouncer':
+        # milliseconds; with PgBouncer set it on the database role instead,
+        # startup options are rejected in transaction pooling
+        if url.drivername.endswith('+asyncpg'):
+            connect_args['server_settings'] = {'statement_timeout': str(statement_timeout)}
+        else:
+            connect_args['options'] = '-c statement_timeout={}'.format(statement_timeout)
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+def setting_pairs(value):
+    '''
+    {key: value} of a 'key=value,key=value' setting (or a dict)
+    '''
+    if isinstance(value, dict):
+        return value
+    pairs = (item.split('=', 1) for item in (value or '').split(',') if item.strip())
+    return {key.strip(): value.strip() for key, value in pairs}
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, database_path
+    defaults to default_database_path(). replicas is an optional list of
+    read replica URIs (default: DB_REPLICAS, comma separated, from
+    app.config or env). Tenant shards are read from DB_SHARDS
+    ('name=uri,...') and TENANT_SHARDS ('tenant=name,...').
+    Nothing connects to the database here: engines connect on first use
+    and the schema is managed with `flask db-upgrade`, or migrated here
+    when DB_AUTO_MIGRATE is set.
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replicas=None):
+    if database_path is None:
+        database_path = default_database_path()
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, database_path)
+    if replicas is None:
+        replicas = app.config.get('DB_REPLICAS', os.getenv('DB_REPLICAS')) or []
+        if isinstance(replicas, str):
+            replicas = [uri.strip() for uri in replicas.split(',') if uri.strip()]
+    replica_router.init_app(app, replicas)
+    shard_router.init_app(
+        app,
+        setting_pairs(app.config.get('DB_SHARDS', os.getenv('DB_SHARDS'))),
+        setting_pairs(app.config.get('TENANT_SHARDS', os.getenv('TENANT_SHARDS')))
+    )
     db.app = app
     db.init_app(app)
-    db.create_all()
+    replica_router.watch(db.engines)
+    auto_migrate = app.config.get('DB_AUTO_MIGRATE', os.getenv('DB_AUTO_MIGRATE', ''))
+    if str(auto_migrate).lower() in ('1', 'true', 'yes'):
+        # schema is versioned in migrations.py, every shard has the same
+        from migrations import upgrade
+        for engine in shard_router.engines(db.engines):
+            upgrade(engine)
+
+"""
+question_listeners
+    callbacks run after a question write is committed, as
+    listener(action, record): action is 'insert', 'update' or 'delete',
+    record is the formatted question, or None when many rows changed at once
+"""
+question_listeners = []
+
+def notify_question_write(action, record=None):
+    for listener in question_listeners:
+        listener(action, record)
 
 """
 Question
 
 """
-class Question(db.Model):
+class Question(TenantScoped, db.Model):
     __tablename__ = 'questions'
+    # created by migrations 3, 5 and 7 on existing databases
+    __table_args__ = (
+        # a question can only be in a category of its own tenant
+        ForeignKeyConstraint(['tenant', 'category'], ['categories.tenant', 'categories.id'],
+                             name='questions_tenant_category_fkey'),
+        Index('ix_questions_tenant_category_id', 'tenant', 'category', 'id'),
+        # listings of a tenant in id order, ORDER BY id LIMIT without a sort
+        Index('ix_questions_tenant_id', 'tenant', 'id'),
+        Index('ix_questions_difficulty', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer)
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -53,14 +435,21 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        record = self.format()
         db.session.commit()
+        notify_question_write('insert', record)
 
     def update(self):
+        record = self.format()
         db.session.commit()
+        notify_question_write('update', record)
 
     def delete(self):
+        record = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_write('delete', record)
 
     def format(self):
         return {
@@ -71,12 +460,32 @@ class Question(db.Model):
             'difficulty': self.difficulty
             }
 
+"""
+question_columns(), format_row(row)
+    read path for listings: selecting these columns instead of Question
+    entities gives plain tuples, with no identity map or attribute
+    instrumentation per row, and format_row() turns one into the same
+    dict as Question.format(). Writes keep using the Question model.
+"""
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+def question_columns():
+    return [getattr(Question, field) for field in QUESTION_FIELDS]
+
+def format_row(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
 """
 Category
 
 """
-class Category(db.Model):
+class Category(TenantScoped, db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        Index('ix_categories_tenant', 'tenant'),
+        # target of the (tenant, category) foreign key of questions
+        UniqueConstraint('tenant', 'id', name='uq_categories_tenant_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     type = Column(String)
@@ -84,8 +493,39 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
-            }
\ No newline at end of file
+            }
+
+"""
+Score
+    one finished quiz of a player. category is 0 for quizzes over all
+    categories. The leaderboard (flaskr/leaderboard.py) buffers new
+    scores and reads the best ones through the score indexes.
+"""
+class Score(TenantScoped, db.Model):
+    __tablename__ = 'scores'
+    # created by migration 6 on existing databases
+    __table_args__ = (
+        Index('ix_scores_tenant_category_score', 'tenant', 'category', 'score'),
+        Index('ix_scores_tenant_score', 'tenant', 'score'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False)
+    category = Column(Integer, nullable=False, default=0)
+    score = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    def format(self):
+        return {
+            'player': self.player,
+            'category': self.category,
+            'score': self.score
+            }
@@ -1,10 +1,15 @@
 import os
+import gzip
+import asyncio
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, Question, Category, db
+from migrations import MIGRATIONS, current_version, upgrade
 from dotenv import load_dotenv
 
 # load .env file in backend dir using python-dotenv lib
@@ -30,26 +35,27 @@ load_dotenv(env_file)
 
 # normal flow of code here;
 # read variables from .env file with os.getenv() to connect to trivia_test db
+def trivia_test_database():
+    return 'postgresql://{}:{}@{}/{}'.format(
+        os.getenv('DB_USER'), os.getenv('DB_PASS'), os.getenv('DB_HOST'), os.getenv('DB_TEST')
+    )
+
+
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Migrate the test db once; apps do not touch the schema on startup."""
+        app = create_app({'DATABASE_PATH': trivia_test_database()})
+        with app.app_context():
+            upgrade(db.engine)
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.database_path = trivia_test_database()
+        self.app = create_app({'DATABASE_PATH': self.database_path})
         self.client = self.app.test_client
-        self.database_name = os.getenv('DB_TEST')
-        self.db_host = os.getenv('DB_HOST')
-        self.db_password = os.getenv('DB_PASS')
-        self.db_user = os.getenv('DB_USER')
-        self.database_path = 'postgresql://{}:{}@{}/{}'.format(self.db_user, self.db_password, self.db_host, self.database_name)
-        setup_db(self.app, self.database_path)
-        
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
     
         # test data for creationg a new question
         self.test_question = {
@@ -71,6 +77,19 @@ class TriviaTestCase(unittest.TestCase):
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
+    ## TESTS for startup
+    def test_startup_without_database(self):
+        # nothing connects on startup, so a down database does not stop it
+        app = create_app({'DATABASE_PATH': 'postgresql://nobody@127.0.0.1:1/trivia'})
+        steps = [name for name, seconds in app.extensions['startup_profile'].steps]
+        self.assertIn('setup_db', steps)
+        self.assertIn('routes', steps)
+
+    ## TESTS for schema migrations
+    def test_schema_is_migrated(self):
+        with self.app.app_context():
+            self.assertEqual(current_version(db.engine), MIGRATIONS[-1][0])
+
     ## TESTS for retrieve categories_GET
     def test_200_retrieve_categories(self):
         res = self.client().get('/categories')
@@ -80,6 +99,13 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_categories'])
         self.assertTrue(len(data['categories']))
         
+    def test_304_retrieve_categories_not_modified(self):
+        res = self.client().get('/categories')
+        cached = self.client().get('/categories', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+
     def test_405_invalid_retrive_catgories(self):
         res = self.client().get('/categories/7', json={'foo': 1})
         data = json.loads(res.data)
@@ -97,6 +123,55 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(data['total_questions'])
         
+    def test_200_retrieve_questions_with_cursor(self):
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+        next_res = self.client().get('/questions?after_id={}'.format(data['next_cursor']))
+        next_data = json.loads(next_res.data)
+        self.assertEqual(next_res.status_code, 200)
+        self.assertEqual(next_data['success'], True)
+        self.assertTrue(len(next_data['questions']))
+        self.assertTrue(next_data['questions'][0]['id'] > data['next_cursor'])
+
+    def test_200_retrieve_questions_from_cache(self):
+        self.client().get('/questions?page=2')
+        res = self.client().get('/questions?page=2')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+
+    def test_200_retrieve_questions_gzip(self):
+        for _ in range(2):
+            res = self.client().get('/questions?page=1', headers={'Accept-Encoding': 'gzip'})
+            data = json.loads(gzip.decompress(res.data))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', res.headers['Vary'])
+            self.assertTrue(len(data['questions']))
+
+    def test_200_cache_invalidated_by_new_question(self):
+        before = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+        self.client().post('/questions', json=self.test_question)
+        res = self.client().get('/categories/1/questions')
+        data = json.loads(res.data)
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(data['total_questions'], before + 1)
+
+    def test_200_cache_entries_expire(self):
+        app = create_app({'DATABASE_PATH': self.database_path, 'RESPONSE_CACHE_TTL': 1})
+        app.test_client().get('/questions?page=2')
+        time.sleep(1.1)
+        res = app.test_client().get('/questions?page=2')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+    def test_200_cache_bypassed_after_own_write(self):
+        client = self.client()
+        client.post('/questions', json=self.test_question)
+        client.get('/categories/1/questions')
+        res = client.get('/categories/1/questions')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Cache', res.headers)
+
     def test_404_retrieve_beyond_valid_questions_page(self):
         res = self.client().get('questions/?page=73', json={'pagefoo': 73})
         data = json.loads(res.data)
@@ -124,6 +199,28 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'request unprocessable')
         
 
+    def test_200_bulk_update_and_delete_questions(self):
+        res = self.client().post('/questions/import', data=json.dumps(self.test_question), content_type='application/x-ndjson')
+        self.assertEqual(json.loads(res.data)['inserted'], 1)
+        with self.app.app_context():
+            question_id = Question.query.order_by(Question.id.desc()).first().id
+
+        res = self.client().patch('/questions', json={'ids': [question_id], 'set': {'difficulty': 5}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+
+        res = self.client().delete('/questions', json={'ids': [question_id, 100000]})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 1)
+
+    def test_400_bulk_delete_without_selection(self):
+        res = self.client().delete('/questions', json={'filter': {}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     ## TESTS create question_POST
     def test_200_add_question(self):
         res = self.client().post('/questions', json=self.test_question)
@@ -132,6 +229,17 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['created'], 24)
 
+    def test_200_total_questions_counts_new_question(self):
+        before = json.loads(self.client().get('/questions').data)['total_questions']
+        self.client().post('/questions', json=self.test_question)
+        after = json.loads(self.client().get('/questions').data)['total_questions']
+        self.assertEqual(after, before + 1)
+
+    def test_200_add_question_reads_from_primary(self):
+        res = self.client().post('/questions', json=self.test_question)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_primary_until', res.headers.get('Set-Cookie', ''))
+
     def test_422_failed_add_question(self):
         res = self.client().post('/questions/7', json=self.test_question)
         data = json.loads(res.data)
@@ -141,6 +249,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 405)
         
         
+    ## TESTS bulk import/export questions
+    def test_200_bulk_import_questions(self):
+        rows = '\n'.join([json.dumps(self.test_question), '{"question": ""}'])
+        res = self.client().post('/questions/import', data=rows, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['rejected'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+
+    def test_200_bulk_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.data.decode().splitlines()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(json.loads(lines[0])['question'])
+
     ### TESTS questions/seach questions_POST
     def test_200_search_questions_results(self):
         res = self.client().post('/questions/search', json={"searchTerm": "title"})
@@ -150,6 +276,12 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']), 2)
         self.assertEqual(data['total_questions'], 2)
 
+    def test_200_search_ranked_page_without_cursor(self):
+        data = json.loads(self.client().post('/questions/search', json={"searchTerm": "title"}).data)
+        self.assertNotIn('next_cursor', data)
+        data = json.loads(self.client().post('/questions/search?after_id=0', json={"searchTerm": "title"}).data)
+        self.assertIn('next_cursor', data)
+
     def test_200_no_search_results(self):
         res = self.client().post('/questions/search', json={"searchTerm": "GTA"})
         data = json.loads(res.data)
@@ -158,6 +290,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['total_questions'], 0)
         self.assertEqual(len(data['questions']), 0)
     
+    def test_200_search_results_cached(self):
+        first = json.loads(self.client().post('/questions/search', json={"searchTerm": "title"}).data)
+        second = json.loads(self.client().post('/questions/search', json={"searchTerm": "  TITLE "}).data)
+        self.assertEqual(first, second)
+
+    def test_200_autocomplete(self):
+        res = self.client().get('/questions/autocomplete?q=tit')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('title', data['suggestions'])
+
+    def test_400_search_without_term(self):
+        res = self.client().post('/questions/search', json={"searchTerm": ""})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_404_invalid_search(self):
         res = self.client().post('/questions/search/1', json={"searchTerm": "GTA"})
         data = json.loads(res.data)
@@ -176,6 +326,14 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['current_category'])
         self.assertTrue(len(data['questions']))
         
+    def test_200_stream_categorised_questions(self):
+        res = self.client().get('/categories/1/questions', headers={'Accept': 'application/x-ndjson'})
+        questions = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(questions))
+        self.assertTrue(all(str(question['category']) == '1' for question in questions))
+
     def test_404_invalid_catgorised_questions(self):
         res = self.client().get('/categories/1/questions/7', json={'foo': 1})
         data = json.loads(res.data)
@@ -205,6 +363,28 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         
+    def test_200_quiz_skips_previous_questions(self):
+        '''
+        Test that a question already played is not drawn again
+        '''
+        res = self.client().post('/quizzes', json={"quiz_category": {"id": 1}, "previous_questions": [20, 21]})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], [20, 21])
+
+    def test_200_quiz_prefetch_round(self):
+        '''
+        Test for a round of distinct unseen questions in one request
+        '''
+        res = self.client().post('/quizzes', json={"quiz_category": 0, "previous_questions": [20], "count": 5})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertNotIn(20, ids)
+
     def test_404_failed_quizz(self):
         '''
         Test for out_of_range_category random question
@@ -215,8 +395,226 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['error'], 404)
         self.assertEqual(data['message'], 'resource not found')
-                         
-                         
+
+    ## TESTS for quiz sessions_POST
+    def test_200_quiz_session_next_questions(self):
+        res = self.client().post('/quizzes/sessions', json={"quiz_category": {"id": 1}})
+        session_id = json.loads(res.data)['session_id']
+        first = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id)).data)
+        second = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id)).data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(first['success'], True)
+        self.assertEqual(second['played'], 2)
+        self.assertNotEqual(first['question']['id'], second['question']['id'])
+
+    def test_200_adaptive_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={"adaptive": True, "difficulty": 2})
+        data = json.loads(res.data)
+        self.assertEqual(data['difficulty'], 2)
+        next_url = '/quizzes/sessions/{}/next'.format(data['session_id'])
+        self.client().post(next_url)
+        self.client().post(next_url, json={"correct": True})
+        data = json.loads(self.client().post(next_url, json={"correct": True}).data)
+        self.assertEqual(data['difficulty'], 3)
+        data = json.loads(self.client().post(next_url, json={"correct": False}).data)
+        self.assertEqual(data['difficulty'], 2)
+
+    def test_422_quiz_session_answer_without_question(self):
+        res = self.client().post('/quizzes/sessions', json={"quiz_category": {"id": 1}})
+        next_url = '/quizzes/sessions/{}/next'.format(json.loads(res.data)['session_id'])
+        res = self.client().post(next_url, json={"correct": True})
+        self.assertEqual(res.status_code, 422)
+        self.client().post(next_url)
+        res = self.client().post(next_url, json={"correct": True})
+        self.assertEqual(res.status_code, 200)
+
+    def test_200_quiz_after_delete_by_another_process(self):
+        tenant = {'X-Tenant': 'quiz_stale'}
+        res = self.client().post('/categories', json={'type': 'Stale'}, headers=tenant)
+        category = json.loads(res.data).get('created')
+        if category is None:
+            categories = json.loads(self.client().get('/categories', headers=tenant).data)['categories']
+            category = int(next(id for id, type in categories.items() if type == 'Stale'))
+        question = dict(self.test_question, category=category)
+        ids = [json.loads(self.client().post('/questions', json=question, headers=tenant).data)['created'] for _ in range(2)]
+        quiz = {"quiz_category": {"id": category}, "previous_questions": []}
+        self.client().post('/quizzes', json=quiz, headers=tenant)
+        # deleted behind the back of the quiz index
+        with self.app.app_context():
+            db.session.execute(text('DELETE FROM questions WHERE id = :id'), {'id': ids[0]})
+            db.session.commit()
+        for _ in range(5):
+            res = self.client().post('/quizzes', json=quiz, headers=tenant)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(json.loads(res.data)['question']['id'], ids[0])
+
+    def test_200_quiz_by_difficulty(self):
+        res = self.client().post('/quizzes', json={"quiz_category": 0, "previous_questions": [], "difficulty": 1, "count": 2})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['difficulty'] for question in data['questions']], [1, 1])
+
+    def test_404_unknown_quiz_session(self):
+        res = self.client().post('/quizzes/sessions/foo/next')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    ## TESTS for scores and the leaderboard
+    def test_200_submit_score_and_leaderboard(self):
+        res = self.client().post('/scores', json={"player": "ada", "score": 1000, "category": 1})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(data['rank'])
+
+        data = json.loads(self.client().get('/leaderboard?category=1&limit=1').data)
+        self.assertEqual(data['scores'][0]['score'], 1000)
+        self.assertEqual(data['scores'][0]['rank'], 1)
+
+    def test_400_body_not_a_json_object(self):
+        for method, path in (('post', '/questions'), ('post', '/questions/search'),
+                             ('delete', '/questions'), ('patch', '/questions'), ('post', '/categories'),
+                             ('post', '/quizzes/sessions'), ('post', '/scores')):
+            res = getattr(self.client(), method)(path, json=[1, 2])
+            self.assertEqual(res.status_code, 400)
+
+    def test_400_submit_score_with_invalid_session_id(self):
+        res = self.client().post('/scores', json={'player': 'ada', 'session_id': [1]})
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_submit_score_without_player(self):
+        res = self.client().post('/scores', json={"score": 3})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    ## TESTS for rate limits
+    def test_429_search_rate_limited(self):
+        app = create_app({'DATABASE_PATH': self.database_path, 'RATE_LIMIT_ENABLED': True, 'RATE_LIMIT_SEARCH': '1/60'})
+        first = app.test_client().post('/questions/search', json={'searchTerm': 'title'})
+        res = app.test_client().post('/questions/search', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['message'], 'too many requests')
+        self.assertTrue(int(res.headers['Retry-After']) > 0)
+
+    def test_429_quiz_sessions_rate_limited_per_forwarded_client(self):
+        app = create_app({'DATABASE_PATH': self.database_path, 'RATE_LIMIT_ENABLED': True,
+                          'RATE_LIMIT_QUIZ': '1/60', 'TRUSTED_PROXIES': 1})
+        client = app.test_client()
+        first = client.post('/quizzes/sessions', headers={'X-Forwarded-For': '10.0.0.1'})
+        other = client.post('/quizzes/sessions', headers={'X-Forwarded-For': '10.0.0.2'})
+        res = client.post('/quizzes/sessions', headers={'X-Forwarded-For': '10.0.0.1'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(res.status_code, 429)
+
+    ## TESTS for tenants
+    def test_200_tenant_question_banks_isolated(self):
+        tenant = {'X-Tenant': 'test_tenant'}
+        res = self.client().post('/categories', json={'type': 'Tenant science'}, headers=tenant)
+        category = json.loads(res.data).get('created')
+        if category is None:
+            category = json.loads(self.client().get('/categories', headers=tenant).data)['categories']
+            category = next(id for id, type in category.items() if type == 'Tenant science')
+        question = dict(self.test_question, question='Only in the test tenant?', category=category)
+        res = self.client().post('/questions', json=question, headers=tenant)
+        self.assertEqual(res.status_code, 200)
+        search = {'searchTerm': 'Only in the test tenant'}
+        own = json.loads(self.client().post('/questions/search', json=search, headers=tenant).data)
+        other = json.loads(self.client().post('/questions/search', json=search).data)
+        self.assertTrue(own['total_questions'] >= 1)
+        self.assertEqual(other['total_questions'], 0)
+
+    def test_422_question_in_category_of_other_tenant(self):
+        res = self.client().post('/questions', json=self.test_question, headers={'X-Tenant': 'test_tenant'})
+        self.assertEqual(res.status_code, 422)
+
+    def test_200_new_category_read_from_primary(self):
+        res = self.client().post('/categories', json={'type': 'Sticky {}'.format(time.time())})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_primary_until', res.headers.get('Set-Cookie', ''))
+
+    def test_422_duplicate_category(self):
+        res = self.client().post('/categories', json={'type': 'Science'})
+        self.assertEqual(res.status_code, 422)
+
+    def test_400_category_without_type(self):
+        res = self.client().post('/categories', json={'type': ' '})
+        self.assertEqual(res.status_code, 400)
+
+    def test_200_responses_vary_by_tenant(self):
+        res = self.client().get('/categories')
+        self.assertIn('X-Tenant', res.headers.get('Vary', ''))
+
+    def test_400_invalid_tenant(self):
+        res = self.client().get('/questions', headers={'X-Tenant': 'not a tenant'})
+        self.assertEqual(res.status_code, 400)
+
+    ## TESTS for metrics_GET
+    def test_200_metrics(self):
+        res = self.client().get('/questions')
+        self.assertIn('db;dur=', res.headers.get('Server-Timing'))
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count{method="GET",route="/questions",status="200"}',
+                      res.get_data(as_text=True))
+
+
+class AsyncTriviaTestCase(unittest.TestCase):
+    """This class represents the trivia test case for the async (ASGI) app"""
+
+    def setUp(self):
+        """Initialize the async app on the trivia_test db."""
+        from flaskr.asgi import create_async_app
+        self.database_path = 'postgresql+asyncpg://{}:{}@{}/{}'.format(
+            os.getenv('DB_USER'), os.getenv('DB_PASS'), os.getenv('DB_HOST'), os.getenv('DB_TEST')
+        )
+        self.app = create_async_app({'ASYNC_DATABASE_URI': self.database_path})
+
+    def request(self, method, path, **kwargs):
+        async def send():
+            async with self.app.test_app():
+                res = await getattr(self.app.test_client(), method)(path, **kwargs)
+                return res.status_code, json.loads(await res.get_data())
+        return asyncio.run(send())
+
+    def test_200_async_retrieve_paginated_questions(self):
+        status, data = self.request('get', '/questions?page=1')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertTrue(data['total_questions'])
+
+    def test_200_async_quiz(self):
+        status, data = self.request('post', '/quizzes', json={"quiz_category": {"id": 1}, "previous_questions": []})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['question'])
+
+    def test_400_async_search_without_term(self):
+        status, data = self.request('post', '/questions/search', json={'searchTerm': 42})
+        self.assertEqual(status, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_422_async_question_in_category_of_other_tenant(self):
+        question = {'question': 'q', 'answer': 'a', 'difficulty': 1, 'category': 1}
+        status, data = self.request('post', '/questions', json=question, headers={'X-Tenant': 'async_tenant'})
+        self.assertEqual(status, 422)
+
+    def test_200_async_search_page_without_cursor(self):
+        status, data = self.request('post', '/questions/search', json={'searchTerm': 'title'})
+        self.assertEqual(status, 200)
+        self.assertNotIn('next_cursor', data)
+
+    def test_404_async_quiz_without_body(self):
+        status, data = self.request('post', '/quizzes')
+        self.assertEqual(status, 404)
+        self.assertEqual(data['success'], False)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -14,6 +14,7 @@ class QuizView extends Component {
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false,
     };
@@ -48,6 +49,19 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // the rest of the round was prefetched with the first question
+    if (this.state.upcomingQuestions.length) {
+      const [currentQuestion, ...upcomingQuestions] = this.state.upcomingQuestions;
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: currentQuestion,
+        upcomingQuestions: upcomingQuestions,
+        guess: '',
+      });
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: 'POST',
@@ -56,18 +70,21 @@ class QuizView extends Component {
       data: JSON.stringify({
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: questionsPerPlay - previousQuestions.length,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
+        const [currentQuestion, ...upcomingQuestions] = result.questions;
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
-          currentQuestion: result.question,
+          currentQuestion: currentQuestion || {},
+          upcomingQuestions: upcomingQuestions,
           guess: '',
-          forceEnd: result.question ? false : true,
+          forceEnd: currentQuestion ? false : true,
         });
         return;
       },
@@ -94,6 +111,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false,
     });
@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -14,6 +16,33 @@ class Search extends Component {
     this.setState({
       query: this.search.value,
     });
+    this.getSuggestions(this.search.value);
+  };
+
+  // completes the word being typed, from /questions/autocomplete
+  getSuggestions = (query) => {
+    const words = query.split(' ');
+    const prefix = words.pop();
+    if (!prefix) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    $.ajax({
+      url: `/questions/autocomplete?q=${encodeURIComponent(prefix)}&limit=5`,
+      type: 'GET',
+      success: (result) => {
+        this.setState({
+          suggestions: result.suggestions.map((word) =>
+            [...words, word].join(' ')
+          ),
+        });
+        return;
+      },
+      error: (error) => {
+        this.setState({ suggestions: [] });
+        return;
+      },
+    });
   };
 
   render() {
@@ -23,7 +52,13 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='search-suggestions'
         />
+        <datalist id='search-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion} value={suggestion} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );